@@ -0,0 +1,90 @@
+#-----------------------------------------------------------------------#
+#   benchmark_server.py用于测试server.py的吞吐量与延迟。
+#   多个线程同时向服务发送同一张图片，统计每秒处理的请求数，
+#   以及请求延迟的p50与p99，需要先启动server.py。
+#-----------------------------------------------------------------------#
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+#-------------------------------------------------------------------------#
+#   url                 检测服务的地址
+#   image_path          用于测试的双目图片，左右图像拼接在一起
+#   num_requests        发送的请求总数
+#   concurrency         同时发送请求的线程数，模拟同时调用服务的进程数
+#   depth               是否计算距离
+#   warmup_requests     预热的请求数，不参与统计
+#-------------------------------------------------------------------------#
+url             = "http://127.0.0.1:8000"
+image_path      = "img/street.jpg"
+num_requests    = 200
+concurrency     = 8
+depth           = True
+warmup_requests = 10
+
+def post_image(url, body, depth):
+    request = urllib.request.Request(url + "/predict?depth=%d" % int(depth), data=body,
+                                     headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+#---------------------------------------------------#
+#   concurrency个线程分担num_requests个请求，返回每个请求的延迟与总耗时
+#---------------------------------------------------#
+def run_load(url, body, depth, num_requests, concurrency):
+    latencies   = []
+    errors      = []
+    lock        = threading.Lock()
+    counter     = iter(range(num_requests))
+
+    def worker():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            t1 = time.time()
+            try:
+                post_image(url, body, depth)
+            except OSError as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.time() - t1)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t1 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), errors, time.time() - t1
+
+if __name__ == "__main__":
+    with open(image_path, "rb") as f:
+        body = f.read()
+
+    print(get_json(url + "/health"))
+    run_load(url, body, depth, warmup_requests, concurrency)
+    stats_before            = get_json(url + "/stats")
+    latencies, errors, total_time = run_load(url, body, depth, num_requests, concurrency)
+    stats_after             = get_json(url + "/stats")
+
+    if len(errors) > 0:
+        print("%d requests failed, first error: %s" % (len(errors), errors[0]))
+    if len(latencies) == 0:
+        raise ValueError("没有成功的请求，请检查服务是否正常运行。")
+    batches = stats_after["batches"] - stats_before["batches"]
+    images  = stats_after["images"] - stats_before["images"]
+    print("requests: %d, concurrency: %d, depth: %s" % (len(latencies), concurrency, depth))
+    print("throughput: %.2f requests/s" % (len(latencies) / total_time))
+    print("latency p50: %.2f ms, p99: %.2f ms, max: %.2f ms" % (np.percentile(latencies, 50) * 1000,
+            np.percentile(latencies, 99) * 1000, latencies.max() * 1000))
+    print("mean batch size: %.2f" % (images / batches if batches > 0 else 0.0))
@@ -0,0 +1,46 @@
+#-----------------------------------------------------------------------#
+#   capture_shm.py读取摄像头（视频）的双目图像，写入共享内存的环形缓冲区。
+#   检测进程运行predict.py的mode = 'shm'，直接在共享内存上预测，
+#   帧在进程之间传递时不再pickle与复制，可以启动多个检测进程分担不同的帧。
+#-----------------------------------------------------------------------#
+import time
+
+import cv2
+
+from utils.utils_shm import SharedFrameRing
+
+if __name__ == "__main__":
+    #-------------------------------------------------------------------------#
+    #   video_path          摄像头的编号或视频的路径，与predict.py中的设置相同
+    #   shm_name            共享内存的名字，与predict.py中的shm_name保持一致
+    #   shm_slots           缓冲区中保存的帧数，检测进程落后超过该帧数时旧的帧会被覆盖
+    #   frame_shape         帧的最大尺寸[h, w, c]，左右图像拼接在一起
+    #-------------------------------------------------------------------------#
+    video_path      = 0
+    shm_name        = "yolo_frames"
+    shm_slots       = 8
+    frame_shape     = [480, 1280, 3]
+
+    capture = cv2.VideoCapture(video_path)
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, frame_shape[1])
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_shape[0])
+    ring    = SharedFrameRing.create(shm_name, shm_slots, frame_shape)
+    print("Write frames to shared memory %s, press Ctrl+C to stop." % shm_name)
+
+    t1          = time.time()
+    frame_id    = -1
+    try:
+        while True:
+            ref, frame = capture.read()
+            if not ref:
+                break
+            frame_id = ring.write(frame)
+            if (frame_id + 1) % 100 == 0:
+                print("frames: %d, fps: %.2f" % (frame_id + 1, (frame_id + 1) / (time.time() - t1)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
+        ring.close()
+        ring.unlink()
+    print("Captured %d frames." % (frame_id + 1))
@@ -14,6 +14,24 @@ def autopad(k, p=None):
         p = k // 2 if isinstance(k, int) else [x // 2 for x in k] 
     return p
 
+#---------------------------------------------------#
+#   把BatchNorm合并到卷积的权重与偏置当中
+#   y = gamma * (Wx - mean) / sqrt(var + eps) + beta
+#---------------------------------------------------#
+@torch.no_grad()
+def fuse_conv_and_bn(conv, bn):
+    fusedconv = nn.Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size, stride=conv.stride,
+                          padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True).requires_grad_(False).to(conv.weight.device)
+
+    w_conv  = conv.weight.clone().reshape(conv.out_channels, -1)
+    w_bn    = torch.diag(bn.weight.div(torch.sqrt(bn.eps + bn.running_var)))
+    fusedconv.weight.copy_(torch.mm(w_bn, w_conv).view(fusedconv.weight.shape))
+
+    b_conv  = torch.zeros(conv.weight.size(0), device=conv.weight.device) if conv.bias is None else conv.bias
+    b_bn    = bn.bias - bn.weight.mul(bn.running_mean).div(torch.sqrt(bn.running_var + bn.eps))
+    fusedconv.bias.copy_(torch.mm(w_bn, b_conv.reshape(-1, 1)).reshape(-1) + b_bn)
+    return fusedconv
+
 class Conv(nn.Module):
     def __init__(self, c1, c2, k=1, s=1, p=None, g=1, act=True):
         super(Conv, self).__init__()
@@ -27,6 +45,15 @@ class Conv(nn.Module):
     def forward_fuse(self, x):
         return self.act(self.conv(x))
 
+    #---------------------------------------------------#
+    #   只用于预测，合并后不能再训练
+    #---------------------------------------------------#
+    def fuse(self):
+        self.conv       = fuse_conv_and_bn(self.conv, self.bn)
+        delattr(self, 'bn')
+        self.forward    = self.forward_fuse
+        return self
+
 class Bottleneck(nn.Module):
     # Standard bottleneck
     def __init__(self, c1, c2, shortcut=True, g=1, e=0.5):  # ch_in, ch_out, shortcut, groups, expansion
@@ -96,3 +96,61 @@ class YoloBody(nn.Module):
         out0 = self.yolo_head_P5(P5)
         return out0, out1, out2
 
+    #---------------------------------------------------#
+    #   预测时把所有Conv中的BatchNorm合并进卷积
+    #   合并后的模型不能再训练，也不能再载入未合并的权重
+    #---------------------------------------------------#
+    def fuse(self):
+        for m in self.modules():
+            if isinstance(m, Conv) and hasattr(m, 'bn'):
+                m.fuse()
+        return self
+
+
+#---------------------------------------------------#
+#   在网络中完成解码，结果与DecodeBox.decode_box堆叠后相同
+#   网格与先验框按input_shape预先生成并保存为buffer，
+#   只用到张量运算，可以被torch.jit.trace与onnx导出
+#---------------------------------------------------#
+class YoloDecode(nn.Module):
+    def __init__(self, anchors, anchors_mask, num_classes, input_shape):
+        super(YoloDecode, self).__init__()
+        self.num_anchors    = [len(mask) for mask in anchors_mask]
+        self.bbox_attrs     = 5 + num_classes
+        for i, stride in enumerate([32, 16, 8]):
+            h, w            = input_shape[0] // stride, input_shape[1] // stride
+            grid_x          = torch.arange(w, dtype=torch.float32).view(1, w).expand(h, w)
+            grid_y          = torch.arange(h, dtype=torch.float32).view(h, 1).expand(h, w)
+            grid            = torch.stack((grid_x, grid_y), -1).view(1, 1, h, w, 2)
+            anchor          = torch.tensor(anchors[anchors_mask[i]], dtype=torch.float32)
+            anchor          = (anchor / torch.tensor([input_shape[1] / w, input_shape[0] / h])).view(1, -1, 1, 1, 2)
+            self.register_buffer('grid%d' % i, grid)
+            self.register_buffer('anchor%d' % i, anchor)
+            self.register_buffer('scale%d' % i, torch.tensor([w, h], dtype=torch.float32))
+
+    def forward(self, inputs):
+        outputs = []
+        for i, input in enumerate(inputs):
+            grid, anchor, scale = getattr(self, 'grid%d' % i), getattr(self, 'anchor%d' % i), getattr(self, 'scale%d' % i)
+            #-----------------------------------------------#
+            #   batch_size, 3, 20, 20, 85
+            #-----------------------------------------------#
+            prediction  = input.view(input.shape[0], self.num_anchors[i], self.bbox_attrs, input.shape[2], input.shape[3]).permute(0, 1, 3, 4, 2)
+            prediction  = torch.sigmoid(prediction.float())
+            xy          = (prediction[..., 0:2] * 2. - 0.5 + grid) / scale
+            wh          = (prediction[..., 2:4] * 2) ** 2 * anchor / scale
+            outputs.append(torch.cat((xy, wh, prediction[..., 4:]), -1).reshape(input.shape[0], -1, self.bbox_attrs))
+        return torch.cat(outputs, 1)
+
+#---------------------------------------------------#
+#   预测用的完整模型，输入图片，输出解码后的预测框
+#   batch_size, num_anchors, 4 + 1 + num_classes
+#---------------------------------------------------#
+class YoloInference(nn.Module):
+    def __init__(self, body, anchors, anchors_mask, num_classes, input_shape):
+        super(YoloInference, self).__init__()
+        self.body   = body
+        self.decode = YoloDecode(anchors, anchors_mask, num_classes, input_shape)
+
+    def forward(self, x):
+        return self.decode(self.body(x))
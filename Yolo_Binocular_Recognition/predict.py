@@ -8,6 +8,9 @@ import cv2
 import numpy as np
 from PIL import Image
 
+from utils.utils_pipeline import StagePipeline
+from utils.utils_results import Detections
+from utils.utils_stereo import DisparityWindow
 from yolo import YOLO
 
 if __name__ == "__main__":
@@ -20,6 +23,9 @@ if __name__ == "__main__":
     #   'dir_predict'       表示遍历文件夹进行检测并保存。默认遍历img文件夹，保存img_out文件夹，详情查看下方注释。
     #   'heatmap'           表示进行预测结果的热力图可视化，详情查看下方注释。
     #   'export_onnx'       表示将模型导出为onnx，需要pytorch1.7.1以上。
+    #   'precision'         表示比较yolo.py中precision与channels_last设置下与fp32的预测结果，使用fps_image_path的图片，
+    #                       超出容差时报错，可以用来检查低精度推理是否可靠。
+    #   'shm'               表示从共享内存读取capture_shm.py写入的帧进行检测，详情查看下方注释。
     # ----------------------------------------------------------------------------------------------------------#
     mode = "video"
     # -------------------------------------------------------------------------#
@@ -43,21 +49,54 @@ if __name__ == "__main__":
     video_save_path = ""
     video_fps       = 25.0
     # ----------------------------------------------------------------------------------------------------------#
+    #   video_queue_size    视频检测时流水线各阶段之间队列的长度，越大占用内存越多、延迟越高
+    #
+    #   video_queue_size仅在mode='video'时有效
+    # ----------------------------------------------------------------------------------------------------------#
+    video_queue_size = 2
+    # ----------------------------------------------------------------------------------------------------------#
     #   test_interval       用于指定测量fps的时候，图片检测的次数。理论上test_interval越大，fps越准确。
     #   fps_image_path      用于指定测试的fps图片
     #
-    #   test_interval和fps_image_path仅在mode='fps'有效
+    #   precision_box_tol   mode='precision'时匹配框坐标允许的最大差值，单位为像素
+    #   precision_conf_tol  mode='precision'时匹配框得分允许的最大差值，超出容差时报错
+    #
+    #   test_interval仅在mode='fps'有效，fps_image_path在mode='fps'和mode='precision'有效
     # ----------------------------------------------------------------------------------------------------------#
     test_interval   = 100
     fps_image_path  = "img/street.jpg"
+    precision_box_tol   = 2.0
+    precision_conf_tol  = 0.02
     # -------------------------------------------------------------------------#
     #   dir_origin_path     指定了用于检测的图片的文件夹路径
-    #   dir_save_path       指定了检测完图片的保存路径
+    #   dir_save_path       指定了检测完图片的保存路径，已经保存过结果的图片会被跳过，
+    #                       中断后重新运行即可继续
+    #   dir_batch_size      每次送入网络的图片数量
+    #   dir_load_workers    读取图片与计算视差的线程数
+    #   dir_save_workers    绘制与保存结果的线程数
     #
-    #   dir_origin_path和dir_save_path仅在mode='dir_predict'时有效
+    #   以上参数仅在mode='dir_predict'时有效
     # -------------------------------------------------------------------------#
     dir_origin_path = "img/"
     dir_save_path   = "img_out/"
+    dir_batch_size      = 8
+    dir_load_workers    = 4
+    dir_save_workers    = 2
+    # -------------------------------------------------------------------------#
+    #   shm_name            共享内存的名字，与capture_shm.py中的shm_name保持一致
+    #   shm_rank            当前检测进程的序号
+    #   shm_world           检测进程的总数，第shm_rank个进程只处理frame_id % shm_world == shm_rank的帧，
+    #                       启动多个进程即可把检测分到多个核心上
+    #   shm_timeout         超过该秒数没有新的帧时退出
+    #   shm_depth           是否计算距离
+    #
+    #   以上参数仅在mode='shm'时有效
+    # -------------------------------------------------------------------------#
+    shm_name        = "yolo_frames"
+    shm_rank        = 0
+    shm_world       = 1
+    shm_timeout     = 5.0
+    shm_depth       = True
     # -------------------------------------------------------------------------#
     #   heatmap_save_path   热力图的保存路径，默认保存在model_data下
     #
@@ -67,18 +106,23 @@ if __name__ == "__main__":
     # -------------------------------------------------------------------------#
     #   simplify            使用Simplify onnx
     #   onnx_save_path      指定了onnx的保存路径
+    #   onnx_dynamic_batch  导出的onnx的batch_size是否可变
+    #   onnx_decode         是否把解码一起导出，yolo_onnx.py中的OnnxYOLO需要设置为True
     # -------------------------------------------------------------------------#
-    simplify        = True
-    onnx_save_path  = "model_data/models.onnx"
+    simplify            = True
+    onnx_save_path      = "model_data/models.onnx"
+    onnx_dynamic_batch  = True
+    onnx_decode         = True
 
     if mode == "predict":
         '''
         1、如果想要进行检测完的图片的保存，利用r_image.save("img.jpg")即可保存，直接在predict.py里进行修改即可。 
-        2、如果想要获得预测框的坐标，可以进入yolo.detect_image函数，在绘图部分读取top，left，bottom，right这四个值。
-        3、如果想要利用预测框截取下目标，可以进入yolo.detect_image函数，在绘图部分利用获取到的top，left，bottom，right这四个值
-        在原图上利用矩阵的方式进行截取。
-        4、如果想要在预测图上写额外的字，比如检测到的特定目标的数量，可以进入yolo.detect_image函数，在绘图部分对predicted_class进行判断，
-        比如判断if predicted_class == 'car': 即可判断当前目标是否为车，然后记录数量即可。利用draw.text即可写字。
+        2、如果想要获得预测框的坐标与距离，可以调用detections = yolo.predict(image)，
+        detections.boxes为top，left，bottom，right，detections.xyz为三维坐标，detections.to_list()可以直接转换为json。
+        不需要距离时使用yolo.predict(image, depth = False)，跳过双目计算。
+        3、如果想要利用预测框截取下目标，可以设置crop = True，或者调用yolo.crop_detections(left, detections)。
+        4、如果想要在预测图上写额外的字，比如检测到的特定目标的数量，可以利用detections.names或detections.counts()进行判断，
+        比如判断if predicted_class == 'car': 即可判断当前目标是否为车，然后记录数量即可。在yolo.render绘制后利用draw.text即可写字。
         '''
         while True:
             img = input('Input image filename:')
@@ -150,46 +194,92 @@ if __name__ == "__main__":
         if not ref:
             raise ValueError("未能正确读取摄像头（视频），请注意是否正确安装摄像头（是否正确填写视频路径）。")
 
-        fps = 0.0
-        cv2.createTrackbar("num", "depth", 6, 10, lambda x: None)
-        cv2.createTrackbar("blockSize", "depth", 10, 25, lambda x: None)
+        # ----------------------------------------------------------------------------------------------------------#
+        #   读取、校正、视差、检测、绘制分别在不同的线程中进行，阶段之间用长度为video_queue_size的队列连接，
+        #   第N+1帧的视差计算可以与第N帧的网络预测同时进行。显示与滑动条仍在主线程中完成。
+        # ----------------------------------------------------------------------------------------------------------#
+        def read_frame():
+            ref, frame = capture.read()
+            return frame if ref else None
 
-        while(True):
-            t1 = time.time()
-            # 读取某一帧
-            ref, frame = capture.read()          
-            
-            if not ref:
-                break
-            # 格式转变，BGRtoRGB
-            frame = cv2.cvtColor(frame,cv2.COLOR_BGR2RGB)
-            # 转变成Image
-            frame = Image.fromarray(np.uint8(frame))
-            # 进行检测
-            frame = np.array(yolo.detect_image(frame))
+        def rectify_stage(frame):
+            img1_rectified, img2_rectified = yolo.stereo.rectify(frame)
+            # 左目的BGR图像直接用于检测，不再转换成Image
+            left = frame[:, :frame.shape[1] // 2]
+            return {"left": left, "img1_rectified": img1_rectified, "img2_rectified": img2_rectified}
+
+        def stereo_stage(item):
+            item["disparity"] = None
+            if yolo.depth_mode != "roi":
+                item["disparity"] = yolo.compute_disparity(item["img1_rectified"], item["img2_rectified"])
+            return item
+
+        def detect_stage(item):
+            item["results"] = yolo.inference(item["left"], bgr = True)
+            return item
+
+        def render_stage(item):
+            if item["results"] is None:
+                item["frame"] = np.ascontiguousarray(item["left"])
+                return item
+            height, width = item["left"].shape[:2]
+            detections = Detections.from_results(item["results"], yolo.class_names, (width, height))
+            yolo.measure_depth(detections, item["img1_rectified"], item["img2_rectified"], item["disparity"])
+            yolo.print_detections(detections)
+            if yolo.render_cv2:
+                item["frame"] = yolo.render_bgr(np.ascontiguousarray(item["left"]), detections)
+                return item
+            # 只有需要绘制时才转换成RGB的Image
+            image = Image.fromarray(cv2.cvtColor(item["left"], cv2.COLOR_BGR2RGB))
+            image = yolo.render(image, detections)
             # RGBtoBGR满足opencv显示格式
-            frame = cv2.cvtColor(frame,cv2.COLOR_RGB2BGR)
-
-            fps  = ( fps + (1./(time.time()-t1)) ) / 2
-            print("fps= %.2f"%(fps))
-            frame = cv2.putText(frame, "fps= %.2f"%(fps), (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-            cv2.imshow("video",frame)
-            c= cv2.waitKey(1) & 0xff 
-            # if video_save_path!="":
-            #     out.write(frame)
-
-            if c==27:
-                capture.release()
-                break
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
-
-        print("Video Detection Done!")
-        capture.release()
-        # if video_save_path!="":
-        #     print("Save processed video to the path :" + video_save_path)
-        #     out.release()
+            item["frame"] = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            return item
+
+        pipeline = StagePipeline(read_frame, [
+            ("rectify", rectify_stage),
+            ("stereo", stereo_stage),
+            ("detect", detect_stage),
+            ("render", render_stage),
+        ], maxsize = video_queue_size)
+
+        fps = 0.0
+        # 显示视差图，并用滑动条调节SGBM参数
+        disparity_window = DisparityWindow("depth", yolo.stereo)
+
+        # ---------------------------------------------------------#
+        #   某个阶段出错时pipeline会重新抛出异常，
+        #   在finally中停止各个线程并释放摄像头与视频文件
+        # ---------------------------------------------------------#
+        t1 = time.time()
+        try:
+            for item in pipeline:
+                if item["disparity"] is not None:
+                    disparity_window(item["disparity"])
+                frame = item["frame"]
+
+                fps  = ( fps + (1./(time.time()-t1)) ) / 2
+                t1   = time.time()
+                print("fps= %.2f"%(fps))
+                frame = cv2.putText(frame, "fps= %.2f"%(fps), (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+                cv2.imshow("video",frame)
+                c= cv2.waitKey(1) & 0xff 
+                # if video_save_path!="":
+                #     out.write(frame)
+
+                if c==27:
+                    break
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+        finally:
+            pipeline.stop()
+            pipeline.print_summary()
+            print("Video Detection Done!")
+            capture.release()
+            if video_save_path!="":
+                print("Save processed video to the path :" + video_save_path)
+                out.release()
         cv2.destroyAllWindows()
 
     elif mode == "fps":
@@ -198,19 +288,11 @@ if __name__ == "__main__":
         print(str(tact_time) + ' seconds, ' + str(1/tact_time) + 'FPS, @batch_size 1')
 
     elif mode == "dir_predict":
-        import os
-
-        from tqdm import tqdm
+        from utils.utils_dir_predict import DirPredictor
 
-        img_names = os.listdir(dir_origin_path)
-        for img_name in tqdm(img_names):
-            if img_name.lower().endswith(('.bmp', '.dib', '.png', '.jpg', '.jpeg', '.pbm', '.pgm', '.ppm', '.tif', '.tiff')):
-                image_path  = os.path.join(dir_origin_path, img_name)
-                image       = Image.open(image_path)
-                r_image     = yolo.detect_image(image)
-                if not os.path.exists(dir_save_path):
-                    os.makedirs(dir_save_path)
-                r_image.save(os.path.join(dir_save_path, img_name.replace(".jpg", ".png")), quality=95, subsampling=0)
+        predictor = DirPredictor(yolo, batch_size = dir_batch_size, load_workers = dir_load_workers, save_workers = dir_save_workers)
+        saved, skipped, failed = predictor.run(dir_origin_path, dir_save_path)
+        print("Saved %d images to %s, skipped %d, failed %d." % (saved, dir_save_path, skipped, failed))
 
     elif mode == "heatmap":
         while True:
@@ -224,7 +306,46 @@ if __name__ == "__main__":
                 yolo.detect_heatmap(image, heatmap_save_path)
 
     elif mode == "export_onnx":
-        yolo.convert_to_onnx(simplify, onnx_save_path)
+        yolo.convert_to_onnx(simplify, onnx_save_path, dynamic_batch = onnx_dynamic_batch, decode = onnx_decode)
+
+    elif mode == "precision":
+        img = Image.open(fps_image_path)
+        num_ref, num_res, matched, box_diff, conf_diff, passed = yolo.compare_precision(img, box_tol = precision_box_tol, conf_tol = precision_conf_tol)
+        print("fp32 boxes: %d, %s boxes: %d, matched: %d" % (num_ref, yolo.precision, num_res, matched))
+        print("max box diff: %.3f pixels, max score diff: %.5f" % (box_diff, conf_diff))
+        if not passed:
+            raise ValueError("%s与fp32的预测结果超出容差（box_tol = %.2f，conf_tol = %.3f）。" % (yolo.precision, precision_box_tol, precision_conf_tol))
+        print("Precision check passed.")
+
+    elif mode == "shm":
+        from utils.utils_shm import SharedFrameRing
+
+        ring        = SharedFrameRing.attach(shm_name)
+        frame_id    = -1
+        detected    = 0
+        dropped     = 0
+        t1          = time.time()
+        try:
+            while True:
+                frame = ring.next_frame(frame_id, shm_rank, shm_world, timeout = shm_timeout)
+                if frame is None:
+                    break
+                frame_id    = frame.frame_id
+                detections  = yolo.predict_frame(frame.array, depth = shm_depth)
+                # ---------------------------------------------------------#
+                #   检测期间这一帧被新的帧覆盖，结果不可信
+                # ---------------------------------------------------------#
+                if not frame.valid():
+                    dropped += 1
+                    continue
+                detected += 1
+                print("frame %d: %d objects, latency %.2f ms" % (frame_id, len(detections), (time.time() - frame.timestamp) * 1000))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            frame = None
+            ring.close()
+        print("Detected %d frames, dropped %d, fps: %.2f" % (detected, dropped, detected / (time.time() - t1)))
 
     else:
-        raise AssertionError("Please specify the correct mode: 'predict', 'video', 'fps', 'heatmap', 'export_onnx', 'dir_predict'.")
+        raise AssertionError("Please specify the correct mode: 'predict', 'video', 'fps', 'heatmap', 'export_onnx', 'dir_predict', 'precision', 'shm'.")
@@ -0,0 +1,122 @@
+#-----------------------------------------------------------------------#
+#   quantize.py用于生成静态INT8量化的预测模型，量化后的模型只能在CPU上运行。
+#   使用验证集的图片进行校准，然后在验证集上比较fp32与int8的mAP和推理时间。
+#   生成的模型保存在model_path旁边，在yolo.py里面设置int8 = True即可使用。
+#   model_path、classes_path等参数与yolo.py中的设置保持一致。
+#-----------------------------------------------------------------------#
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from nets.yolo import YoloInference
+from utils.dataloader import YoloDataset, yolo_dataset_collate
+from utils.utils_map import get_map
+from utils.utils_quant import quantize_model
+from yolo import YOLO, get_jit_path
+
+
+#---------------------------------------------------#
+#   网络前向传播加解码的平均耗时，不包括预处理与非极大抑制
+#---------------------------------------------------#
+def measure_latency(yolo, test_interval):
+    images = torch.rand(1, 3, yolo.input_shape[0], yolo.input_shape[1])
+    with torch.no_grad():
+        yolo.decode(yolo.run_net(images))
+        t1 = time.time()
+        for _ in range(test_interval):
+            yolo.decode(yolo.run_net(images))
+        t2 = time.time()
+    return (t2 - t1) / test_interval
+
+#---------------------------------------------------#
+#   与EvalCallback相同，生成预测结果与真实框的txt后计算mAP
+#---------------------------------------------------#
+def evaluate_map(yolo, val_lines, map_out_path, MINOVERLAP):
+    for sub_dir in ["ground-truth", "detection-results"]:
+        if not os.path.exists(os.path.join(map_out_path, sub_dir)):
+            os.makedirs(os.path.join(map_out_path, sub_dir))
+    for annotation_line in tqdm(val_lines):
+        line        = annotation_line.split()
+        image_id    = os.path.basename(line[0]).split('.')[0]
+        image       = Image.open(line[0])
+        gt_boxes    = np.array([np.array(list(map(int,box.split(',')))) for box in line[1:]])
+
+        yolo.get_map_txt(image_id, image, yolo.class_names, map_out_path)
+        with open(os.path.join(map_out_path, "ground-truth/"+image_id+".txt"), "w") as new_f:
+            for box in gt_boxes:
+                left, top, right, bottom, obj = box
+                obj_name = yolo.class_names[obj]
+                new_f.write("%s %s %s %s %s\n" % (obj_name, left, top, right, bottom))
+    return get_map(MINOVERLAP, False, path = map_out_path)
+
+if __name__ == "__main__":
+    #------------------------------------------------------------------#
+    #   val_annotation_path     验证集的标签，用于校准与计算mAP
+    #   calib_num_images        用于校准的图片数量，一般一两百张就足够了
+    #   calib_batch_size        校准时的batch_size
+    #   backend                 量化后端，x86与fbgemm用于x86的CPU，qnnpack用于ARM的CPU
+    #                           生成模型与部署时使用的后端需要一致
+    #------------------------------------------------------------------#
+    val_annotation_path = '2007_val.txt'
+    calib_num_images    = 128
+    calib_batch_size    = 8
+    backend             = 'x86'
+    #------------------------------------------------------------------#
+    #   eval_map                是否在验证集上比较fp32与int8的mAP
+    #   MINOVERLAP              计算mAP时使用的IOU阈值
+    #   map_out_path            预测结果与真实框的txt保存的文件夹，计算完成后删除
+    #   test_interval           测量推理时间时的检测次数
+    #------------------------------------------------------------------#
+    eval_map            = True
+    MINOVERLAP          = 0.5
+    map_out_path        = '.temp_quant_map_out'
+    test_interval       = 50
+
+    with open(val_annotation_path, encoding='utf-8') as f:
+        val_lines = f.readlines()
+
+    #------------------------------------------------------------------#
+    #   计算mAP时与get_map相同，使用很低的置信度保留尽可能多的预测框
+    #------------------------------------------------------------------#
+    yolo = YOLO(cuda = False, precision = 'fp32', jit = False, int8 = False, confidence = 0.001, nms_iou = 0.5)
+
+    #------------------------------------------------------------------#
+    #   校准使用YoloDataset的验证集预处理，不进行数据增强
+    #------------------------------------------------------------------#
+    calib_dataset   = YoloDataset(val_lines[:calib_num_images], yolo.input_shape, yolo.num_classes, yolo.anchors, yolo.anchors_mask, epoch_length = 0, \
+                                    mosaic = False, mixup = False, mosaic_prob = 0, mixup_prob = 0, train = False)
+    calib_loader    = DataLoader(calib_dataset, shuffle = False, batch_size = calib_batch_size, num_workers = 0, pin_memory = False,
+                                    drop_last = False, collate_fn = yolo_dataset_collate)
+    quant_net       = quantize_model(yolo.net, calib_loader, yolo.input_shape, backend)
+
+    #------------------------------------------------------------------#
+    #   与jit模型相同，把解码一起trace进模型
+    #------------------------------------------------------------------#
+    quant_net       = YoloInference(quant_net, yolo.anchors, yolo.anchors_mask, yolo.num_classes, yolo.input_shape).eval()
+    with torch.no_grad():
+        quant_net   = torch.jit.trace(quant_net, torch.zeros(1, 3, yolo.input_shape[0], yolo.input_shape[1]))
+    int8_path       = get_jit_path(yolo.model_path, yolo.input_shape, yolo.phi, yolo.num_classes, yolo.anchors, yolo.anchors_mask,
+                                   yolo.channels_last, int8 = True)
+    quant_net.save(int8_path)
+    print("Save INT8 model to {}".format(int8_path))
+
+    yolo_int8       = YOLO(cuda = False, precision = 'fp32', jit = False, int8 = True, confidence = 0.001, nms_iou = 0.5)
+
+    fp32_time       = measure_latency(yolo, test_interval)
+    int8_time       = measure_latency(yolo_int8, test_interval)
+    if eval_map:
+        fp32_map    = evaluate_map(yolo, val_lines, os.path.join(map_out_path, 'fp32'), MINOVERLAP)
+        int8_map    = evaluate_map(yolo_int8, val_lines, os.path.join(map_out_path, 'int8'), MINOVERLAP)
+        shutil.rmtree(map_out_path)
+
+    print("backend: %s, calibration images: %d" % (backend, len(calib_dataset)))
+    print("fp32: %.2f ms, int8: %.2f ms, speedup: %.2fx" % (fp32_time * 1000, int8_time * 1000, fp32_time / int8_time))
+    if eval_map:
+        print("fp32 mAP@%.2f: %.2f%%, int8 mAP@%.2f: %.2f%%, delta: %+.2f%%" \
+            % (MINOVERLAP, fp32_map * 100, MINOVERLAP, int8_map * 100, (int8_map - fp32_map) * 100))
@@ -0,0 +1,39 @@
+#-----------------------------------------------------------------------#
+#   server.py启动本机的检测服务，多个进程共用同一份模型。
+#   POST /predict?depth=1   请求体为左右拼接的双目图片（jpg、png等文件的字节），
+#                           返回json格式的检测结果，depth=0时不计算距离
+#   GET  /health            服务是否可用
+#   GET  /stats             合批的次数与平均batch大小
+#   模型的设置与yolo.py相同，可以用benchmark_server.py测试吞吐量与延迟。
+#-----------------------------------------------------------------------#
+from utils.utils_server import InferenceServer, InferenceService
+from yolo import YOLO
+
+if __name__ == "__main__":
+    #-------------------------------------------------------------------------#
+    #   host                监听的地址，默认只接受本机的请求
+    #   port                监听的端口
+    #   max_batch_size      一次网络预测最多合并的请求数
+    #   max_latency         第一个请求到达后最多等待的秒数，等待期间到达的请求合并成一个batch
+    #                       越大合批越充分、吞吐量越高，但单个请求的延迟也会增加
+    #   depth_workers       同时计算视差的请求数，每个都使用一份独立的SGBM匹配器
+    #   verbose             是否打印每个请求的日志
+    #-------------------------------------------------------------------------#
+    host            = "127.0.0.1"
+    port            = 8000
+    max_batch_size  = 8
+    max_latency     = 0.005
+    depth_workers   = 2
+    verbose         = False
+
+    yolo    = YOLO()
+    service = InferenceService(yolo, max_batch_size, max_latency, depth_workers)
+    server  = InferenceServer(service, host, port, verbose)
+    print("Serving on http://%s:%d" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,152 @@
+#-----------------------------------------------------------------------#
+#   stereo_benchmark.py用于测试双目深度引擎的速度与精度，
+#   benchmark = 'roi'           比较全图视差与只在目标框附近计算视差的耗时
+#   benchmark = 'resolution'    比较不同缩放比例与SGBM模式的帧率与深度误差
+#-----------------------------------------------------------------------#
+import time
+
+import cv2
+import numpy as np
+
+from yolo import YOLO, get_calibration
+from utils.utils_stereo import StereoDepthEngine
+
+#-------------------------------------------------------------------------#
+#   benchmark           测试的内容，可选'roi'与'resolution'
+#   video_path          用于测试的双目视频，左右图像拼接在一起
+#   test_frames         参与统计的帧数
+#   num_boxes           每帧随机生成的目标框个数，模拟每帧1~5个目标的情况
+#   box_size            目标框的高和宽
+#   resolution_configs  benchmark = 'resolution'时测试的(stereo_scale, stereo_mode)，
+#                       第一项作为计算深度误差的参考
+#-------------------------------------------------------------------------#
+benchmark       = "roi"
+video_path      = "video/1.avi"
+test_frames     = 100
+num_boxes       = 3
+box_size        = [120, 80]
+resolution_configs = [(1, "HH"), (0.5, "HH"), (0.5, "HH4"), (0.5, "SGBM"), (0.5, "3WAY"), (0.25, "SGBM")]
+
+def random_boxes(rng, image_shape, num_boxes, box_size):
+    height, width   = image_shape[:2]
+    box_h, box_w    = box_size
+    tops    = rng.randint(0, height - box_h, num_boxes)
+    lefts   = rng.randint(0, width - box_w, num_boxes)
+    return [(t, l, t + box_h - 1, l + box_w - 1) for t, l in zip(tops, lefts)]
+
+def centers_of(boxes):
+    return [(int(np.floor((t + b) / 2)), int(np.floor((l + r) / 2))) for t, l, b, r in boxes]
+
+#---------------------------------------------------#
+#   原有做法：整幅视差 + 整幅点云，再读取框中心
+#---------------------------------------------------#
+def full_depth(engine, img1_rectified, img2_rectified, boxes):
+    disparity   = engine.compute(img1_rectified, img2_rectified)
+    threeD      = engine.reproject(disparity)
+    return [threeD[y][x] for y, x in centers_of(boxes)]
+
+#---------------------------------------------------#
+#   稀疏做法：只在框附近计算视差，只对框中心求三维坐标
+#---------------------------------------------------#
+def roi_depth(engine, img1_rectified, img2_rectified, boxes):
+    xyz = []
+    for box, (y, x) in zip(boxes, centers_of(boxes)):
+        disparity, offset   = engine.compute_roi(img1_rectified, img2_rectified, box)
+        xyz.append(engine.lookup_xyz(disparity, (x, y), offset, missing = engine.min_disparity * 16 - 1)[0])
+    return xyz
+
+#---------------------------------------------------#
+#   框内视差中值对应的深度，与depth_stat = 'median'一致
+#---------------------------------------------------#
+def box_depth(engine, frame, boxes):
+    img1_rectified, img2_rectified = engine.rectify(frame)
+    disparity   = engine.compute(img1_rectified, img2_rectified)
+    xyz, _      = engine.box_xyz(disparity, boxes)
+    return xyz[:, 2]
+
+def read_frames(video_path, test_frames):
+    capture = cv2.VideoCapture(video_path)
+    frames  = []
+    while len(frames) < test_frames:
+        ref, frame = capture.read()
+        if not ref:
+            break
+        frames.append(frame)
+    capture.release()
+    if len(frames) == 0:
+        raise ValueError("未能正确读取视频，请注意是否正确填写视频路径。")
+    return frames
+
+#---------------------------------------------------#
+#   每种配置都从读取好的同一批帧计算，
+#   耗时包括校正、缩放与视差计算，
+#   误差为框内深度相对参考配置的相对误差
+#---------------------------------------------------#
+def resolution_benchmark(calib):
+    frames  = read_frames(video_path, test_frames)
+    rng     = np.random.RandomState(0)
+    height, width = frames[0].shape[0], frames[0].shape[1] // 2
+    boxes   = [random_boxes(rng, (height, width), num_boxes, box_size) for _ in frames]
+
+    reference = None
+    print("frames: %d, boxes per frame: %d, box size: %dx%d" % (len(frames), num_boxes, box_size[0], box_size[1]))
+    print('-' * 70)
+    print('|%8s |%8s |%12s |%8s |%12s |%12s|' % ('scale', 'mode', 'ms / frame', 'fps', 'median err', 'valid'))
+    print('-' * 70)
+    for scale, mode in resolution_configs:
+        engine  = StereoDepthEngine.from_calibration(calib, num = YOLO.get_defaults("stereo_num"),
+                                block_size = YOLO.get_defaults("stereo_block_size"), mode = mode, scale = scale)
+        t1      = time.time()
+        depths  = np.concatenate([box_depth(engine, frame, frame_boxes) for frame, frame_boxes in zip(frames, boxes)])
+        elapsed = (time.time() - t1) / len(frames)
+        if reference is None:
+            reference = depths
+
+        valid   = (depths < 10000 * 16) & (reference < 10000 * 16)
+        error   = np.median(np.abs(depths[valid] - reference[valid]) / np.abs(reference[valid])) if valid.any() else float('nan')
+        print('|%8s |%8s |%12.2f |%8.2f |%11.2f%% |%12.2f|' % (scale, mode, elapsed * 1000, 1 / elapsed, error * 100, valid.mean()))
+    print('-' * 70)
+
+if __name__ == "__main__":
+    calib   = get_calibration(YOLO.get_defaults("stereo_calib_path"))
+    if benchmark == "resolution":
+        resolution_benchmark(calib)
+        raise SystemExit
+
+    engine  = StereoDepthEngine.from_calibration(calib, num = YOLO.get_defaults("stereo_num"),
+                                block_size = YOLO.get_defaults("stereo_block_size"))
+    rng     = np.random.RandomState(0)
+    capture = cv2.VideoCapture(video_path)
+
+    full_times, roi_times, errors = [], [], []
+    while len(full_times) < test_frames:
+        ref, frame = capture.read()
+        if not ref:
+            break
+        img1_rectified, img2_rectified = engine.rectify(frame)
+        boxes = random_boxes(rng, img1_rectified.shape, num_boxes, box_size)
+
+        t1          = time.time()
+        full_xyz    = full_depth(engine, img1_rectified, img2_rectified, boxes)
+        t2          = time.time()
+        roi_xyz     = roi_depth(engine, img1_rectified, img2_rectified, boxes)
+        t3          = time.time()
+
+        full_times.append(t2 - t1)
+        roi_times.append(t3 - t2)
+        for a, b in zip(full_xyz, roi_xyz):
+            if a[2] < 10000 * 16 and b[2] < 10000 * 16:
+                errors.append(abs(float(a[2]) - float(b[2])))
+    capture.release()
+
+    if len(full_times) == 0:
+        raise ValueError("未能正确读取视频，请注意是否正确填写视频路径。")
+
+    full_time   = np.mean(full_times)
+    roi_time    = np.mean(roi_times)
+    print("frames: %d, boxes per frame: %d, box size: %dx%d" % (len(full_times), num_boxes, box_size[0], box_size[1]))
+    print("full : %.2f ms / frame" % (full_time * 1000))
+    print("roi  : %.2f ms / frame" % (roi_time * 1000))
+    print("speed up: %.2fx" % (full_time / roi_time))
+    if len(errors) > 0:
+        print("mean |dZ| between full and roi: %.3f mm over %d points" % (np.mean(errors), len(errors)))
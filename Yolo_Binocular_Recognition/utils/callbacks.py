@@ -135,12 +135,11 @@ class EvalCallback():
             #   将图像输入网络当中进行预测！
             #---------------------------------------------------------#
             outputs = self.net(images)
-            outputs = self.bbox_util.decode_box(outputs)
             #---------------------------------------------------------#
-            #   将预测框进行堆叠，然后进行非极大抑制
+            #   筛选、解码预测框，然后进行非极大抑制
             #---------------------------------------------------------#
-            results = self.bbox_util.non_max_suppression(torch.cat(outputs, 1), self.num_classes, self.input_shape, 
-                        image_shape, self.letterbox_image, conf_thres = self.confidence, nms_thres = self.nms_iou)
+            results = self.bbox_util.decode_nms(outputs, self.input_shape, image_shape, self.letterbox_image, 
+                        conf_thres = self.confidence, nms_thres = self.nms_iou)
                                                     
             if results[0] is None: 
                 return 
@@ -1,3 +1,5 @@
+import math
+
 import numpy as np
 import torch
 from torchvision.ops import nms
@@ -16,6 +18,28 @@ class DecodeBox():
         #   80x80的特征层对应的anchor是[10,13],[16,30],[33,23]
         #-----------------------------------------------------------#
         self.anchors_mask   = anchors_mask
+        self.grid_cache     = {}
+
+    #---------------------------------------------------#
+    #   每个特征层的网格、先验框与归一化系数
+    #   按照特征层大小、device与dtype生成一次后缓存
+    #   grid    1, 1, 2, h, w       网格左上角的x与y
+    #   anchor  1, 3, 2, 1, 1       相对于特征层的先验框宽高
+    #   scale   1, 1, 2, 1, 1       特征层的宽高
+    #---------------------------------------------------#
+    def get_grid(self, i, input_height, input_width, device, dtype):
+        key = (i, tuple(self.input_shape), input_height, input_width, device, dtype)
+        if key not in self.grid_cache:
+            stride_h    = self.input_shape[0] / input_height
+            stride_w    = self.input_shape[1] / input_width
+            grid_x      = torch.arange(input_width, dtype=dtype, device=device).view(1, input_width).expand(input_height, input_width)
+            grid_y      = torch.arange(input_height, dtype=dtype, device=device).view(input_height, 1).expand(input_height, input_width)
+            grid        = torch.stack((grid_x, grid_y), 0).view(1, 1, 2, input_height, input_width)
+            anchor      = torch.tensor([(anchor_width / stride_w, anchor_height / stride_h) for anchor_width, anchor_height in self.anchors[self.anchors_mask[i]]],
+                                        dtype=dtype, device=device).view(1, -1, 2, 1, 1)
+            scale       = torch.tensor([input_width, input_height], dtype=dtype, device=device).view(1, 1, 2, 1, 1)
+            self.grid_cache[key] = (grid, anchor, scale)
+        return self.grid_cache[key]
 
     def decode_box(self, inputs):
         outputs = []
@@ -30,66 +54,15 @@ class DecodeBox():
             batch_size      = input.size(0)
             input_height    = input.size(2)
             input_width     = input.size(3)
+            num_anchors     = len(self.anchors_mask[i])
+            grid, anchor, scale = self.get_grid(i, input_height, input_width, input.device, input.dtype)
 
             #-----------------------------------------------#
-            #   输入为640x640时
-            #   stride_h = stride_w = 32、16、8
-            #-----------------------------------------------#
-            stride_h = self.input_shape[0] / input_height
-            stride_w = self.input_shape[1] / input_width
-            #-------------------------------------------------#
-            #   此时获得的scaled_anchors大小是相对于特征层的
-            #-------------------------------------------------#
-            scaled_anchors = [(anchor_width / stride_w, anchor_height / stride_h) for anchor_width, anchor_height in self.anchors[self.anchors_mask[i]]]
-
-            #-----------------------------------------------#
-            #   输入的input一共有三个，他们的shape分别是
-            #   batch_size, 3, 20, 20, 85
-            #   batch_size, 3, 40, 40, 85
-            #   batch_size, 3, 80, 80, 85
-            #-----------------------------------------------#
-            prediction = input.view(batch_size, len(self.anchors_mask[i]),
-                                    self.bbox_attrs, input_height, input_width).permute(0, 1, 3, 4, 2).contiguous()
-
-            #-----------------------------------------------#
-            #   先验框的中心位置的调整参数
+            #   所有通道都需要sigmoid，在连续的内存上一次完成
+            #   与原先返回output.data相同，结果不参与反向传播
+            #   prediction  batch_size, 3, 85, 20, 20
             #-----------------------------------------------#
-            x = torch.sigmoid(prediction[..., 0])  
-            y = torch.sigmoid(prediction[..., 1])
-            #-----------------------------------------------#
-            #   先验框的宽高调整参数
-            #-----------------------------------------------#
-            w = torch.sigmoid(prediction[..., 2]) 
-            h = torch.sigmoid(prediction[..., 3]) 
-            #-----------------------------------------------#
-            #   获得置信度，是否有物体
-            #-----------------------------------------------#
-            conf        = torch.sigmoid(prediction[..., 4])
-            #-----------------------------------------------#
-            #   种类置信度
-            #-----------------------------------------------#
-            pred_cls    = torch.sigmoid(prediction[..., 5:])
-
-            FloatTensor = torch.cuda.FloatTensor if x.is_cuda else torch.FloatTensor
-            LongTensor  = torch.cuda.LongTensor if x.is_cuda else torch.LongTensor
-
-            #----------------------------------------------------------#
-            #   生成网格，先验框中心，网格左上角 
-            #   batch_size,3,20,20
-            #----------------------------------------------------------#
-            grid_x = torch.linspace(0, input_width - 1, input_width).repeat(input_height, 1).repeat(
-                batch_size * len(self.anchors_mask[i]), 1, 1).view(x.shape).type(FloatTensor)
-            grid_y = torch.linspace(0, input_height - 1, input_height).repeat(input_width, 1).t().repeat(
-                batch_size * len(self.anchors_mask[i]), 1, 1).view(y.shape).type(FloatTensor)
-
-            #----------------------------------------------------------#
-            #   按照网格格式生成先验框的宽高
-            #   batch_size,3,20,20
-            #----------------------------------------------------------#
-            anchor_w = FloatTensor(scaled_anchors).index_select(1, LongTensor([0]))
-            anchor_h = FloatTensor(scaled_anchors).index_select(1, LongTensor([1]))
-            anchor_w = anchor_w.repeat(batch_size, 1).repeat(1, 1, input_height * input_width).view(w.shape)
-            anchor_h = anchor_h.repeat(batch_size, 1).repeat(1, 1, input_height * input_width).view(h.shape)
+            prediction  = torch.sigmoid(input.detach().view(batch_size, num_anchors, self.bbox_attrs, input_height, input_width))
 
             #----------------------------------------------------------#
             #   利用预测结果对先验框进行调整
@@ -99,20 +72,14 @@ class DecodeBox():
             #   y 0 ~ 1 => 0 ~ 2 => -0.5, 1.5 => 负责一定范围的目标的预测
             #   w 0 ~ 1 => 0 ~ 2 => 0 ~ 4 => 先验框的宽高调节范围为0~4倍
             #   h 0 ~ 1 => 0 ~ 2 => 0 ~ 4 => 先验框的宽高调节范围为0~4倍
+            #   最后除以特征层的宽高，将输出结果归一化成小数的形式
             #----------------------------------------------------------#
-            pred_boxes          = FloatTensor(prediction[..., :4].shape)
-            pred_boxes[..., 0]  = x.data * 2. - 0.5 + grid_x
-            pred_boxes[..., 1]  = y.data * 2. - 0.5 + grid_y
-            pred_boxes[..., 2]  = (w.data * 2) ** 2 * anchor_w
-            pred_boxes[..., 3]  = (h.data * 2) ** 2 * anchor_h
-
-            #----------------------------------------------------------#
-            #   将输出结果归一化成小数的形式
-            #----------------------------------------------------------#
-            _scale = torch.Tensor([input_width, input_height, input_width, input_height]).type(FloatTensor)
-            output = torch.cat((pred_boxes.view(batch_size, -1, 4) / _scale,
-                                conf.view(batch_size, -1, 1), pred_cls.view(batch_size, -1, self.num_classes)), -1)
-            outputs.append(output.data)
+            prediction[:, :, 0:2].mul_(2.).sub_(0.5).add_(grid).div_(scale)
+            prediction[:, :, 2:4].mul_(2).pow_(2).mul_(anchor).div_(scale)
+            #-----------------------------------------------#
+            #   只在最后换成batch_size, 3 * 20 * 20, 85的顺序，复制一次
+            #-----------------------------------------------#
+            outputs.append(prediction.permute(0, 1, 3, 4, 2).reshape(batch_size, -1, self.bbox_attrs))
         return outputs
 
     def yolo_correct_boxes(self, box_xy, box_wh, input_shape, image_shape, letterbox_image):
@@ -142,94 +109,189 @@ class DecodeBox():
         boxes *= np.concatenate([image_shape, image_shape], axis=-1)
         return boxes
 
-    def non_max_suppression(self, prediction, num_classes, input_shape, image_shape, letterbox_image, conf_thres=0.5, nms_thres=0.4):
-        #----------------------------------------------------------#
-        #   将预测结果的格式转换成左上角右下角的格式。
-        #   prediction  [batch_size, num_anchors, 85]
-        #----------------------------------------------------------#
-        box_corner          = prediction.new(prediction.shape)
-        box_corner[:, :, 0] = prediction[:, :, 0] - prediction[:, :, 2] / 2
-        box_corner[:, :, 1] = prediction[:, :, 1] - prediction[:, :, 3] / 2
-        box_corner[:, :, 2] = prediction[:, :, 0] + prediction[:, :, 2] / 2
-        box_corner[:, :, 3] = prediction[:, :, 1] + prediction[:, :, 3] / 2
-        prediction[:, :, :4] = box_corner[:, :, :4]
-
-        output = [None for _ in range(len(prediction))]
-        for i, image_pred in enumerate(prediction):
-            #----------------------------------------------------------#
-            #   对种类预测部分取max。
-            #   class_conf  [num_anchors, 1]    种类置信度
-            #   class_pred  [num_anchors, 1]    种类
-            #----------------------------------------------------------#
-            class_conf, class_pred = torch.max(image_pred[:, 5:5 + num_classes], 1, keepdim=True)
+    #---------------------------------------------------#
+    #   分组的非极大抑制，返回按得分从高到低排列的保留下标
+    #   每个分组的框平移到互不重叠的位置后只调用一次nms，
+    #   平移量可能比框大很多，使用float64保证坐标不损失精度
+    #   CPU上nms的耗时与框数的平方成正比，框很多时改为排序后逐段nms
+    #---------------------------------------------------#
+    def batched_nms(self, boxes, scores, groups, nms_thres, max_cpu_boxes=4000):
+        if len(boxes) == 0:
+            return torch.zeros((0,), dtype=torch.long, device=boxes.device)
+        if boxes.is_cuda or len(boxes) <= max_cpu_boxes:
+            boxes   = boxes.double()
+            offsets = groups.double() * (boxes.max() - boxes.min() + 1)
+            return nms(boxes + offsets[:, None], scores.double(), nms_thres)
+
+        #---------------------------------------------------#
+        #   稳定排序，每个分组内保持原来的顺序，得分相同时的结果与逐类nms一致
+        #---------------------------------------------------#
+        order   = torch.argsort(groups * len(groups) + torch.arange(len(groups), device=groups.device))
+        counts  = torch.unique_consecutive(groups[order], return_counts=True)[1].tolist()
+        boxes, scores = boxes[order], scores[order]
+        keep    = []
+        start   = 0
+        for count in counts:
+            keep.append(nms(boxes[start:start + count], scores[start:start + count], nms_thres) + start)
+            start += count
+        keep    = torch.cat(keep)
+        keep    = keep[torch.argsort(scores[keep], descending=True)]
+        return order[keep]
 
-            #----------------------------------------------------------#
-            #   利用置信度进行第一轮筛选
-            #----------------------------------------------------------#
-            conf_mask = (image_pred[:, 4] * class_conf[:, 0] >= conf_thres).squeeze()
+    #---------------------------------------------------#
+    #   按照图片升序、得分降序排列，返回排列的下标与每个框在所属图片中的名次
+    #   得分在0~1之间，图片序号乘2后不同图片的排序键不会重叠
+    #---------------------------------------------------#
+    def sort_by_image(self, image_index, scores, batch_size):
+        order       = torch.argsort(image_index.double() * 2 - scores.double())
+        image_index = image_index[order]
+        counts      = torch.bincount(image_index, minlength=batch_size)
+        starts      = torch.cumsum(counts, 0) - counts
+        rank        = torch.arange(len(order), device=order.device) - starts[image_index]
+        return order, rank
+
+    #---------------------------------------------------#
+    #   从网络的原始输出直接筛选，只解码得分不小于conf_thres的先验框
+    #   sigmoid单调递增，max(sigmoid(cls)) = sigmoid(max(cls))，
+    #   并且obj * cls >= conf_thres时一定有obj >= conf_thres，
+    #   先用obj的logit与logit(conf_thres)比较就能去掉绝大部分先验框，
+    #   剩下的先验框再计算准确的得分与预测框
+    #   返回的detections、scores与image_index与filter_predictions相同
+    #---------------------------------------------------#
+    def decode_filter(self, inputs, conf_thres):
+        all_detections, all_scores, all_image_index = [], [], []
+        for i, input in enumerate(inputs):
+            batch_size      = input.size(0)
+            input_height    = input.size(2)
+            input_width     = input.size(3)
+            num_anchors     = len(self.anchors_mask[i])
+            grid, anchor, scale = self.get_grid(i, input_height, input_width, input.device, input.dtype)
+
+            #-----------------------------------------------#
+            #   prediction  batch_size, 3, 85, 20, 20
+            #   logit(conf_thres)减去一个很小的数，避免舍入误差筛掉边界上的先验框
+            #-----------------------------------------------#
+            prediction  = input.detach().view(batch_size, num_anchors, self.bbox_attrs, input_height, input_width)
+            if 0 < conf_thres < 1:
+                obj_mask = prediction[:, :, 4] >= math.log(conf_thres / (1 - conf_thres)) - 1e-4
+            else:
+                obj_mask = torch.ones_like(prediction[:, :, 4], dtype=torch.bool)
+            index       = obj_mask.nonzero()
+            #-----------------------------------------------#
+            #   candidates  num_candidates, 85
+            #-----------------------------------------------#
+            candidates  = prediction[index[:, 0], index[:, 1], :, index[:, 2], index[:, 3]]
+            class_conf, class_pred = torch.max(candidates[:, 5:5 + self.num_classes], 1)
+            class_conf  = torch.sigmoid(class_conf)
+            scores      = torch.sigmoid(candidates[:, 4]) * class_conf
+
+            keep        = scores >= conf_thres
+            candidates, class_conf, class_pred, scores = candidates[keep], class_conf[keep], class_pred[keep], scores[keep]
+            image_index, anchor_index, grid_y, grid_x = index[keep].unbind(1)
+            box_conf    = torch.sigmoid(candidates[:, :5])
 
             #----------------------------------------------------------#
-            #   根据置信度进行预测结果的筛选
+            #   与decode_box相同的方式调整先验框，只对留下来的先验框进行
             #----------------------------------------------------------#
-            image_pred = image_pred[conf_mask]
-            class_conf = class_conf[conf_mask]
-            class_pred = class_pred[conf_mask]
-            if not image_pred.size(0):
-                continue
+            xy          = (box_conf[:, 0:2] * 2. - 0.5 + grid[0, 0, :, grid_y, grid_x].t()) / scale.view(1, 2)
+            wh          = (box_conf[:, 2:4] * 2) ** 2 * anchor[0, anchor_index, :, 0, 0] / scale.view(1, 2)
             #-------------------------------------------------------------------------#
-            #   detections  [num_anchors, 7]
+            #   detections  [num_boxes, 7]
             #   7的内容为：x1, y1, x2, y2, obj_conf, class_conf, class_pred
             #-------------------------------------------------------------------------#
-            detections = torch.cat((image_pred[:, :5], class_conf.float(), class_pred.float()), 1)
-
-            #------------------------------------------#
-            #   获得预测结果中包含的所有种类
-            #------------------------------------------#
-            unique_labels = detections[:, -1].cpu().unique()
-
-            if prediction.is_cuda:
-                unique_labels = unique_labels.cuda()
-                detections = detections.cuda()
-
-            for c in unique_labels:
-                #------------------------------------------#
-                #   获得某一类得分筛选后全部的预测结果
-                #------------------------------------------#
-                detections_class = detections[detections[:, -1] == c]
-
-                #------------------------------------------#
-                #   使用官方自带的非极大抑制会速度更快一些！
-                #   筛选出一定区域内，属于同一种类得分最大的框
-                #------------------------------------------#
-                keep = nms(
-                    detections_class[:, :4],
-                    detections_class[:, 4] * detections_class[:, 5],
-                    nms_thres
-                )
-                max_detections = detections_class[keep]
-                
-                # # 按照存在物体的置信度排序
-                # _, conf_sort_index = torch.sort(detections_class[:, 4]*detections_class[:, 5], descending=True)
-                # detections_class = detections_class[conf_sort_index]
-                # # 进行非极大抑制
-                # max_detections = []
-                # while detections_class.size(0):
-                #     # 取出这一类置信度最高的，一步一步往下判断，判断重合程度是否大于nms_thres，如果是则去除掉
-                #     max_detections.append(detections_class[0].unsqueeze(0))
-                #     if len(detections_class) == 1:
-                #         break
-                #     ious = bbox_iou(max_detections[-1], detections_class[1:])
-                #     detections_class = detections_class[1:][ious < nms_thres]
-                # # 堆叠
-                # max_detections = torch.cat(max_detections).data
-                
-                # Add max detections to outputs
-                output[i] = max_detections if output[i] is None else torch.cat((output[i], max_detections))
-            
-            if output[i] is not None:
-                output[i]           = output[i].cpu().numpy()
-                box_xy, box_wh      = (output[i][:, 0:2] + output[i][:, 2:4])/2, output[i][:, 2:4] - output[i][:, 0:2]
-                output[i][:, :4]    = self.yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image)
+            all_detections.append(torch.cat((xy - wh / 2, xy + wh / 2, box_conf[:, 4:5], class_conf[:, None], class_pred[:, None].to(input.dtype)), 1))
+            all_scores.append(scores)
+            all_image_index.append(image_index)
+        return torch.cat(all_detections), torch.cat(all_scores), torch.cat(all_image_index)
+
+    #---------------------------------------------------#
+    #   从decode_box堆叠后的结果中筛选得分不小于conf_thres的预测框
+    #---------------------------------------------------#
+    def filter_predictions(self, prediction, num_classes, conf_thres):
+        #----------------------------------------------------------#
+        #   将预测结果的格式转换成左上角右下角的格式。
+        #----------------------------------------------------------#
+        box_corner  = torch.cat((prediction[..., 0:2] - prediction[..., 2:4] / 2, prediction[..., 0:2] + prediction[..., 2:4] / 2), -1)
+
+        #----------------------------------------------------------#
+        #   对种类预测部分取max。
+        #   class_conf  [batch_size, num_anchors]    种类置信度
+        #   class_pred  [batch_size, num_anchors]    种类
+        #----------------------------------------------------------#
+        class_conf, class_pred = torch.max(prediction[..., 5:5 + num_classes], -1)
+        scores      = prediction[..., 4] * class_conf
+
+        #----------------------------------------------------------#
+        #   利用置信度对整个batch进行第一轮筛选
+        #   image_index为每个预测框所属的图片
+        #----------------------------------------------------------#
+        image_index, anchor_index = (scores >= conf_thres).nonzero().unbind(1)
+        #-------------------------------------------------------------------------#
+        #   detections  [num_boxes, 7]
+        #   7的内容为：x1, y1, x2, y2, obj_conf, class_conf, class_pred
+        #-------------------------------------------------------------------------#
+        detections  = torch.cat((box_corner[image_index, anchor_index], prediction[image_index, anchor_index, 4:5],
+                                 class_conf[image_index, anchor_index, None], class_pred[image_index, anchor_index, None].to(prediction.dtype)), 1)
+        return detections, scores[image_index, anchor_index], image_index
+
+    def non_max_suppression(self, prediction, num_classes, input_shape, image_shape, letterbox_image, conf_thres=0.5, nms_thres=0.4, max_det=None, max_nms=30000):
+        #----------------------------------------------------------#
+        #   prediction  [batch_size, num_anchors, 85]
+        #   image_shape 所有图片共用的[h, w]，或者每张图片各自的[batch_size, 2]
+        #   max_det     每张图片最多保留的预测框数量，None时不限制
+        #   max_nms     每张图片进入非极大抑制的最多的预测框数量，
+        #               置信度很低时（如计算mAP时的0.001）只对得分最高的部分进行非极大抑制
+        #----------------------------------------------------------#
+        detections, scores, image_index = self.filter_predictions(prediction, num_classes, conf_thres)
+        return self.suppress(detections, scores, image_index, len(prediction), num_classes, input_shape, image_shape, letterbox_image, nms_thres, max_det, max_nms)
+
+    #---------------------------------------------------#
+    #   decode_box与non_max_suppression合在一起，输入为网络的原始输出
+    #   只解码通过置信度筛选的先验框，结果与两者分开调用时相同
+    #---------------------------------------------------#
+    def decode_nms(self, inputs, input_shape, image_shape, letterbox_image, conf_thres=0.5, nms_thres=0.4, max_det=None, max_nms=30000):
+        detections, scores, image_index = self.decode_filter(inputs, conf_thres)
+        return self.suppress(detections, scores, image_index, inputs[0].size(0), self.num_classes, input_shape, image_shape, letterbox_image, nms_thres, max_det, max_nms)
+
+    #---------------------------------------------------#
+    #   对筛选后的预测框进行非极大抑制，并映射回原图
+    #---------------------------------------------------#
+    def suppress(self, detections, scores, image_index, batch_size, num_classes, input_shape, image_shape, letterbox_image, nms_thres, max_det, max_nms):
+        image_shapes = np.array(image_shape)
+        if image_shapes.ndim == 1:
+            image_shapes = np.tile(image_shapes, (batch_size, 1))
+
+        #----------------------------------------------------------#
+        #   每张图片只保留得分最高的max_nms个框
+        #----------------------------------------------------------#
+        if len(scores) > max_nms:
+            order, rank = self.sort_by_image(image_index, scores, batch_size)
+            order       = order[rank < max_nms]
+            detections, scores, image_index = detections[order], scores[order], image_index[order]
+
+        #----------------------------------------------------------#
+        #   把图片序号与种类合成一个分组，所有图片的所有种类
+        #   一起进行非极大抑制，不同分组的框不会相互抑制
+        #----------------------------------------------------------#
+        keep        = self.batched_nms(detections[:, :4], scores, image_index * num_classes + detections[:, 6].long(), nms_thres)
+        detections, scores, image_index = detections[keep], scores[keep], image_index[keep]
+
+        #----------------------------------------------------------#
+        #   按图片分开，每张图片的结果按得分从高到低排列，最多max_det个
+        #----------------------------------------------------------#
+        order, rank = self.sort_by_image(image_index, scores, batch_size)
+        if max_det is not None:
+            order   = order[rank < max_det]
+        detections  = detections[order].cpu().numpy()
+        counts      = torch.bincount(image_index[order], minlength=batch_size).tolist()
+
+        output = [None for _ in range(batch_size)]
+        for i, image_detections in enumerate(np.split(detections, np.cumsum(counts)[:-1])):
+            if len(image_detections) == 0:
+                continue
+            output[i]           = image_detections
+            box_xy, box_wh      = (output[i][:, 0:2] + output[i][:, 2:4])/2, output[i][:, 2:4] - output[i][:, 0:2]
+            output[i][:, :4]    = self.yolo_correct_boxes(box_xy, box_wh, input_shape, image_shapes[i], letterbox_image)
         return output
     
 
@@ -0,0 +1,97 @@
+import numpy as np
+
+
+#---------------------------------------------------#
+#   把预测框从网络输入的尺度映射回原图
+#   与DecodeBox.yolo_correct_boxes相同，不依赖torch
+#---------------------------------------------------#
+def yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image):
+    #-----------------------------------------------------------------#
+    #   把y轴放前面是因为方便预测框和图像的宽高进行相乘
+    #-----------------------------------------------------------------#
+    box_yx = box_xy[..., ::-1]
+    box_hw = box_wh[..., ::-1]
+    input_shape = np.array(input_shape)
+    image_shape = np.array(image_shape)
+
+    if letterbox_image:
+        new_shape = np.round(image_shape * np.min(input_shape/image_shape))
+        offset  = (input_shape - new_shape)/2./input_shape
+        scale   = input_shape/new_shape
+
+        box_yx  = (box_yx - offset) * scale
+        box_hw *= scale
+
+    box_mins    = box_yx - (box_hw / 2.)
+    box_maxes   = box_yx + (box_hw / 2.)
+    boxes  = np.concatenate([box_mins[..., 0:1], box_mins[..., 1:2], box_maxes[..., 0:1], box_maxes[..., 1:2]], axis=-1)
+    boxes *= np.concatenate([image_shape, image_shape], axis=-1)
+    return boxes
+
+#---------------------------------------------------#
+#   与torchvision.ops.nms相同的非极大抑制
+#   boxes为x1, y1, x2, y2，返回按得分从高到低排列的保留下标
+#---------------------------------------------------#
+def nms(boxes, scores, nms_thres):
+    areas   = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order   = np.argsort(-scores, kind='stable')
+    keep    = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1     = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1     = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2     = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2     = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter   = np.maximum(xx2 - xx1, 0) * np.maximum(yy2 - yy1, 0)
+        #---------------------------------------------------#
+        #   与torchvision相同，面积为0的框iou为nan，不会被抑制
+        #---------------------------------------------------#
+        with np.errstate(invalid='ignore', divide='ignore'):
+            iou = inter / (areas[i] + areas[order[1:]] - inter)
+        order   = order[1:][~(iou > nms_thres)]
+    return np.array(keep, dtype=np.int64)
+
+#---------------------------------------------------#
+#   与DecodeBox.non_max_suppression相同的流程，输入输出均为numpy
+#   prediction  [batch_size, num_anchors, 5 + num_classes]，坐标为归一化的中心与宽高
+#   image_shape 所有图片共用的[h, w]，或者每张图片各自的[batch_size, 2]
+#   max_det     每张图片最多保留的预测框数量，None时不限制
+#   max_nms     每张图片进入非极大抑制的最多的预测框数量
+#---------------------------------------------------#
+def non_max_suppression(prediction, num_classes, input_shape, image_shape, letterbox_image, conf_thres=0.5, nms_thres=0.4, max_det=None, max_nms=30000):
+    prediction  = np.asarray(prediction, dtype=np.float32)
+    image_shapes = np.array(image_shape)
+    if image_shapes.ndim == 1:
+        image_shapes = np.tile(image_shapes, (len(prediction), 1))
+
+    output = [None for _ in range(len(prediction))]
+    for i, image_pred in enumerate(prediction):
+        class_conf  = np.max(image_pred[:, 5:5 + num_classes], 1)
+        class_pred  = np.argmax(image_pred[:, 5:5 + num_classes], 1)
+        scores      = image_pred[:, 4] * class_conf
+
+        candidates  = np.nonzero(scores >= conf_thres)[0]
+        if len(candidates) == 0:
+            continue
+        if len(candidates) > max_nms:
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')[:max_nms]]
+        #-------------------------------------------------------------------------#
+        #   detections  [num_boxes, 7]
+        #   7的内容为：x1, y1, x2, y2, obj_conf, class_conf, class_pred
+        #-------------------------------------------------------------------------#
+        xy, wh      = image_pred[candidates, 0:2], image_pred[candidates, 2:4]
+        detections  = np.concatenate((xy - wh / 2, xy + wh / 2, image_pred[candidates, 4:5], class_conf[candidates, None],
+                                      class_pred[candidates, None].astype(np.float32)), 1)
+
+        #-------------------------------------------------------------------------#
+        #   不同种类的框平移到互不重叠的位置，所有种类只进行一次非极大抑制
+        #-------------------------------------------------------------------------#
+        boxes       = detections[:, :4].astype(np.float64)
+        boxes       = boxes + class_pred[candidates, None] * (boxes.max() - boxes.min() + 1)
+        keep        = nms(boxes, scores[candidates], nms_thres)[:max_det]
+        output[i]   = detections[keep]
+
+        box_xy, box_wh      = (output[i][:, 0:2] + output[i][:, 2:4])/2, output[i][:, 2:4] - output[i][:, 0:2]
+        output[i][:, :4]    = yolo_correct_boxes(box_xy, box_wh, input_shape, image_shapes[i], letterbox_image)
+    return output
@@ -0,0 +1,187 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.utils_results import Detections
+
+IMAGE_EXTENSIONS = ('.bmp', '.dib', '.png', '.jpg', '.jpeg', '.pbm', '.pgm', '.ppm', '.tif', '.tiff')
+
+
+#---------------------------------------------------#
+#   检测结果的保存路径，与原先的dir_predict一致，jpg保存为png
+#---------------------------------------------------#
+def get_save_path(img_name, dir_save_path):
+    return os.path.join(dir_save_path, img_name.replace(".jpg", ".png"))
+
+#---------------------------------------------------#
+#   先写入临时文件再重命名，中断时不会留下不完整的输出，
+#   断点续跑时已经存在的输出都是完整的
+#---------------------------------------------------#
+def save_image(image, save_path):
+    image_format    = Image.registered_extensions().get(os.path.splitext(save_path)[1].lower())
+    temp_path       = save_path + ".part"
+    image.save(temp_path, format=image_format, quality=95, subsampling=0)
+    os.replace(temp_path, save_path)
+
+
+class DirPredictor(object):
+    #---------------------------------------------------#
+    #   流式的文件夹检测，分为三个阶段
+    #   load    线程池读取图片，拆出左目，完成双目校正与视差计算
+    #   detect  主线程把读取完成的图片凑成batch，调用一次detect_batch
+    #   save    线程池计算深度、绘制并保存，不打印每个框的坐标
+    #
+    #   同一时间在流水线中的图片不超过max_pending张，内存有界
+    #   SGBM匹配器不能在多个线程中同时使用，
+    #   load与save的每个线程使用自己的StereoDepthEngine副本
+    #   已经存在的输出会被跳过，中断后重新运行即可从断点继续
+    #---------------------------------------------------#
+    def __init__(self, yolo, batch_size = 8, load_workers = 4, save_workers = 2, max_pending = None):
+        self.yolo           = yolo
+        self.batch_size     = batch_size
+        self.load_workers   = load_workers
+        self.save_workers   = save_workers
+        #---------------------------------------------------#
+        #   提前读取两个batch，使读取与网络预测同时进行
+        #---------------------------------------------------#
+        self.prefetch       = 2 * batch_size
+        self.max_pending    = max(max_pending or 4 * batch_size, self.prefetch)
+        self.local          = threading.local()
+
+    #---------------------------------------------------#
+    #   当前线程的双目深度引擎
+    #---------------------------------------------------#
+    @property
+    def stereo(self):
+        if not hasattr(self.local, "stereo"):
+            self.local.stereo = self.yolo.stereo.clone()
+        return self.local.stereo
+
+    #---------------------------------------------------#
+    #   需要处理的图片，跳过已经保存过结果的图片
+    #---------------------------------------------------#
+    def list_tasks(self, dir_origin_path, dir_save_path):
+        tasks   = []
+        skipped = 0
+        for img_name in sorted(os.listdir(dir_origin_path)):
+            if not img_name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            save_path = get_save_path(img_name, dir_save_path)
+            if os.path.exists(save_path):
+                skipped += 1
+                continue
+            tasks.append((os.path.join(dir_origin_path, img_name), save_path))
+        return tasks, skipped
+
+    #---------------------------------------------------#
+    #   读取图片与计算视差，读取或校正出错时返回None，
+    #   计为失败的图片，不影响其余图片
+    #---------------------------------------------------#
+    def load(self, image_path, save_path):
+        try:
+            with Image.open(image_path) as image:
+                image = image.convert('RGB')
+            frame   = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+            img1_rectified, img2_rectified = self.stereo.rectify(frame)
+            disparity = None
+            if self.yolo.depth_mode != "roi":
+                disparity = self.stereo.compute(img1_rectified, img2_rectified)
+        except Exception as e:
+            print("Load Error! %s: %s" % (image_path, e))
+            return None
+        return {
+            "save_path"         : save_path,
+            "image"             : self.yolo.crop_left(image),
+            "img1_rectified"    : img1_rectified,
+            "img2_rectified"    : img2_rectified,
+            "disparity"         : disparity,
+        }
+
+    def save(self, item, results):
+        image = item["image"]
+        if results is not None:
+            detections  = Detections.from_results(results, self.yolo.class_names, image.size)
+            self.yolo.measure_depth(detections, item["img1_rectified"], item["img2_rectified"], item["disparity"],
+                                    stereo=self.stereo)
+            image       = self.yolo.render(image, detections)
+        save_image(image, item["save_path"])
+
+    #---------------------------------------------------#
+    #   等待一个batch读取完成，预测后交给save线程池
+    #---------------------------------------------------#
+    def detect(self, load_futures, save_pool, pending, on_done):
+        items = []
+        for _ in range(min(self.batch_size, len(load_futures))):
+            item = load_futures.popleft().result()
+            if item is None:
+                pending.release()
+                on_done(None)
+                continue
+            items.append(item)
+        if len(items) == 0:
+            return []
+
+        results = self.yolo.detect_batch([item["image"] for item in items])
+        save_futures = []
+        for item, result in zip(items, results):
+            future = save_pool.submit(self.save, item, result)
+            future.add_done_callback(lambda f: (pending.release(), on_done(f)))
+            save_futures.append(future)
+        return save_futures
+
+    #---------------------------------------------------#
+    #   检测dir_origin_path下所有的图片，结果保存到dir_save_path
+    #   返回保存的图片数、跳过的图片数与读取失败的图片数
+    #---------------------------------------------------#
+    def run(self, dir_origin_path, dir_save_path):
+        from tqdm import tqdm
+
+        if not os.path.exists(dir_save_path):
+            os.makedirs(dir_save_path)
+        tasks, skipped = self.list_tasks(dir_origin_path, dir_save_path)
+        if skipped > 0:
+            print("Skip %d images that already have results in %s." % (skipped, dir_save_path))
+
+        #---------------------------------------------------#
+        #   在主线程中读取标定文件并创建双目深度引擎，
+        #   避免多个load线程同时生成标定文件
+        #---------------------------------------------------#
+        self.yolo.stereo
+        progress    = tqdm(total=len(tasks))
+        lock        = threading.Lock()
+        stats       = {"saved": 0, "failed": 0}
+
+        def on_done(future):
+            with lock:
+                if future is None or future.exception() is not None:
+                    stats["failed"] += 1
+                else:
+                    stats["saved"] += 1
+                progress.update(1)
+
+        pending         = threading.BoundedSemaphore(self.max_pending)
+        load_futures    = deque()
+        save_futures    = []
+        with ThreadPoolExecutor(self.load_workers) as load_pool, ThreadPoolExecutor(self.save_workers) as save_pool:
+            for task in tasks:
+                if len(load_futures) >= self.prefetch:
+                    save_futures += self.detect(load_futures, save_pool, pending, on_done)
+                    #---------------------------------------------------#
+                    #   保存出错时尽早停止，而不是处理完所有图片
+                    #---------------------------------------------------#
+                    for future in [future for future in save_futures if future.done()]:
+                        future.result()
+                    save_futures = [future for future in save_futures if not future.done()]
+                pending.acquire()
+                load_futures.append(load_pool.submit(self.load, *task))
+            while load_futures:
+                save_futures += self.detect(load_futures, save_pool, pending, on_done)
+        for future in save_futures:
+            future.result()
+        progress.close()
+        return stats["saved"], skipped, stats["failed"]
@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+
+
+class StageStats(object):
+    #---------------------------------------------------#
+    #   记录某一个阶段的处理次数与耗时
+    #---------------------------------------------------#
+    def __init__(self, name):
+        self.name   = name
+        self.count  = 0
+        self.total  = 0.0
+        self.lock   = threading.Lock()
+
+    def update(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+
+class StagePipeline(object):
+    #---------------------------------------------------#
+    #   多线程流水线，每个阶段一个线程，阶段之间用有界队列连接
+    #   source      无参函数，每次返回一个item，返回None表示结束
+    #   stages      [(name, fn), ...]，fn接收item并返回处理后的item
+    #   maxsize     每个队列的长度，限制同时在流水线中的帧数
+    #
+    #   cv2与torch在计算时会释放GIL，
+    #   因此第N+1帧的视差计算可以与第N帧的网络预测同时进行
+    #---------------------------------------------------#
+    def __init__(self, source, stages, maxsize = 2):
+        self.source     = source
+        self.stages     = stages
+        self.queues     = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        self.stats      = [StageStats("capture")] + [StageStats(name) for name, _ in stages]
+        self.latency    = StageStats("end_to_end")
+        self.stop_event = threading.Event()
+        self.threads    = []
+        self.start_time = None
+        self.end_time   = None
+        self.error      = None
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _run_source(self):
+        try:
+            while not self.stop_event.is_set():
+                t1      = time.time()
+                item    = self.source()
+                if item is None:
+                    break
+                self.stats[0].update(time.time() - t1)
+                if not self._put(self.queues[0], (t1, item)):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self.queues[0], None)
+
+    def _run_stage(self, index):
+        _, fn   = self.stages[index]
+        q_in    = self.queues[index]
+        q_out   = self.queues[index + 1]
+        try:
+            while True:
+                packet = self._get(q_in)
+                if packet is None:
+                    break
+                t0, item = packet
+                t1      = time.time()
+                item    = fn(item)
+                self.stats[index + 1].update(time.time() - t1)
+                if not self._put(q_out, (t0, item)):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(q_out, None)
+
+    def start(self):
+        self.start_time = time.time()
+        self.threads    = [threading.Thread(target=self._run_source, daemon=True)]
+        self.threads   += [threading.Thread(target=self._run_stage, args=(i,), daemon=True) for i in range(len(self.stages))]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        if self.end_time is None:
+            self.end_time = time.time()
+
+    #---------------------------------------------------#
+    #   按顺序取出处理完成的item
+    #   某个阶段出错时，在这里重新抛出该异常
+    #---------------------------------------------------#
+    def __iter__(self):
+        if self.start_time is None:
+            self.start()
+        while True:
+            packet = self._get(self.queues[-1])
+            if packet is None:
+                break
+            t0, item = packet
+            self.latency.update(time.time() - t0)
+            yield item
+        self.end_time = time.time()
+        if self.error is not None:
+            raise self.error
+
+    #---------------------------------------------------#
+    #   每个阶段的平均耗时、端到端延迟与吞吐量
+    #---------------------------------------------------#
+    def summary(self):
+        end_time    = self.end_time if self.end_time is not None else time.time()
+        elapsed     = end_time - self.start_time if self.start_time is not None else 0.0
+        return {
+            "stages"    : [(stat.name, stat.mean() * 1000) for stat in self.stats],
+            "latency"   : self.latency.mean() * 1000,
+            "frames"    : self.latency.count,
+            "fps"       : self.latency.count / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print('-' * 40)
+        for name, ms in summary["stages"]:
+            print('|%15s | %17.2f ms|' % (name, ms))
+        print('-' * 40)
+        print('|%15s | %17.2f ms|' % ("end_to_end", summary["latency"]))
+        print('|%15s | %16.2f fps|' % ("throughput", summary["fps"]))
+        print('-' * 40)
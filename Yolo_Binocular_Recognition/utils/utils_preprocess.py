@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+
+#---------------------------------------------------#
+#   获得图像的高和宽，PIL图像不需要先转成数组
+#---------------------------------------------------#
+def image_hw(image):
+    if isinstance(image, Image.Image):
+        return np.array([image.size[1], image.size[0]])
+    return np.array(np.shape(image)[0:2])
+
+#---------------------------------------------------#
+#   转成HWC的uint8三通道数组，通道顺序保持不变
+#---------------------------------------------------#
+def to_array(image):
+    if isinstance(image, Image.Image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return np.ascontiguousarray(image[..., :3])
+    return image
+
+
+class Preprocessor(object):
+    #---------------------------------------------------#
+    #   直接在uint8数组上进行resize与归一化的预处理
+    #   letterbox或直接resize后，一次写入预先分配的NCHW float32缓冲区，
+    #   缓冲区就是torch张量的内存，每一帧重复使用
+    #   as_tensor为False时缓冲区为numpy数组，不需要安装torch
+    #
+    #   返回的张量是缓冲区的一部分，下一次调用会覆盖其中的内容，
+    #   因此同一时间只能在一个线程中使用
+    #---------------------------------------------------#
+    def __init__(self, input_shape, letterbox_image, cuda = False, as_tensor = True):
+        self.input_shape        = input_shape
+        self.letterbox_image    = letterbox_image
+        self.cuda               = cuda
+        self.as_tensor          = as_tensor
+        self.buffer             = None
+        self.canvas             = np.full((input_shape[0], input_shape[1], 3), 128, dtype=np.uint8)
+
+    def get_buffer(self, batch_size):
+        if self.buffer is None or self.buffer.shape[0] < batch_size:
+            shape = (batch_size, 3, self.input_shape[0], self.input_shape[1])
+            if self.as_tensor:
+                import torch
+                self.buffer = torch.empty(shape, dtype=torch.float32, pin_memory=self.cuda and torch.cuda.is_available())
+            else:
+                self.buffer = np.empty(shape, dtype=np.float32)
+        return self.buffer[:batch_size]
+
+    #---------------------------------------------------#
+    #   与resize_image相同的缩放方式，返回缩放后的图像与它在画布中的位置
+    #   缩小时使用INTER_AREA，放大时使用INTER_CUBIC
+    #---------------------------------------------------#
+    def resize(self, image):
+        ih, iw  = image.shape[:2]
+        h, w    = self.input_shape
+        if self.letterbox_image:
+            scale   = min(w/iw, h/ih)
+            nw      = int(iw*scale)
+            nh      = int(ih*scale)
+        else:
+            nw, nh  = w, h
+        interpolation = cv2.INTER_AREA if nw < iw else cv2.INTER_CUBIC
+        if (nw, nh) != (iw, ih):
+            image   = cv2.resize(image, (nw, nh), interpolation=interpolation)
+        return image, (h-nh)//2, (w-nw)//2
+
+    def __call__(self, images, bgr = False):
+        buffer  = self.get_buffer(len(images))
+        data    = buffer.numpy() if self.as_tensor else buffer
+        for i, image in enumerate(images):
+            image, dy, dx = self.resize(to_array(image))
+            nh, nw  = image.shape[:2]
+            canvas  = self.canvas
+            if (nh, nw) != tuple(self.input_shape):
+                canvas[:]                       = 128
+                canvas[dy:dy+nh, dx:dx+nw]      = image
+            else:
+                canvas                          = image
+            if bgr:
+                canvas = canvas[..., ::-1]
+            #---------------------------------------------------#
+            #   HWC转CHW、uint8转float32与除以255在一次运算中完成
+            #---------------------------------------------------#
+            np.divide(canvas.transpose(2, 0, 1), np.float32(255.0), out=data[i])
+        if self.cuda:
+            return buffer.cuda(non_blocking=True)
+        return buffer
@@ -0,0 +1,51 @@
+import copy
+
+import torch
+
+
+#---------------------------------------------------#
+#   静态INT8量化只支持CPU，x86与fbgemm用于服务器与桌面，qnnpack用于ARM
+#---------------------------------------------------#
+QUANT_BACKENDS = ['x86', 'fbgemm', 'qnnpack']
+
+def check_backend(backend):
+    if backend not in QUANT_BACKENDS:
+        raise ValueError("Unsupported backend - `{}`, Use {}.".format(backend, ', '.join(QUANT_BACKENDS)))
+    if backend not in torch.backends.quantized.supported_engines:
+        raise ValueError("当前的torch不支持{}量化后端，可选的后端为{}。".format(backend, torch.backends.quantized.supported_engines))
+    torch.backends.quantized.engine = backend
+
+#---------------------------------------------------#
+#   基于校准集的静态INT8量化（FX graph mode）
+#   net         合并BN之后、处于eval状态的YoloBody
+#   dataloader  YoloDataset的DataLoader，只使用其中的图片
+#
+#   SiLU的x * sigmoid(x)会被trace成sigmoid与mul两个算子，
+#   sigmoid使用固定的量化参数，mul的输出在校准时统计量化参数，
+#   因此整个网络都在int8下运行，只在输入和三个输出处进行量化与反量化
+#---------------------------------------------------#
+def quantize_model(net, dataloader, input_shape, backend = 'x86', num_batches = None):
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+    except ImportError:
+        raise ValueError("INT8量化需要torch>=1.13。")
+    check_backend(backend)
+
+    net             = copy.deepcopy(net).cpu().eval()
+    example_inputs  = (torch.zeros(1, 3, input_shape[0], input_shape[1]),)
+    prepared        = prepare_fx(net, get_default_qconfig_mapping(backend), example_inputs)
+
+    #---------------------------------------------------#
+    #   校准，统计每一层激活值的范围
+    #---------------------------------------------------#
+    with torch.no_grad():
+        for iteration, batch in enumerate(dataloader):
+            if num_batches is not None and iteration >= num_batches:
+                break
+            images = batch[0]
+            if not isinstance(images, torch.Tensor):
+                images = torch.from_numpy(images)
+            prepared(images.float())
+            print("Calibrate %d/%d" % (iteration + 1, len(dataloader) if num_batches is None else min(num_batches, len(dataloader))))
+    return convert_fx(prepared).eval()
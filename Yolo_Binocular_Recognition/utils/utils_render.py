@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+class LRUCache(object):
+    #---------------------------------------------------#
+    #   有容量上限的最近最少使用缓存，可以在多个线程中共用
+    #---------------------------------------------------#
+    def __init__(self, maxsize = 1024):
+        self.maxsize    = maxsize
+        self.data       = OrderedDict()
+        self.lock       = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self.data)
+
+
+class LabelRenderer(object):
+    #---------------------------------------------------#
+    #   缓存字体与标签，避免每一帧都重新加载字体、测量文字
+    #   font_path   标签使用的字体
+    #   colors      每个种类的RGB颜色
+    #   max_labels  缓存的标签数量上限
+    #
+    #   标签的文字由种类、两位小数的得分与距离组成，
+    #   同一个视频中重复的标签很多，缓存命中率很高
+    #   FreeType的字体对象不能在多个线程中同时使用，
+    #   因此字体按线程缓存，测量结果与标签图片在线程之间共用
+    #---------------------------------------------------#
+    def __init__(self, font_path, colors, max_labels = 1024):
+        self.font_path  = font_path
+        self.colors     = colors
+        self.sizes      = LRUCache(max_labels)
+        self.sprites    = LRUCache(max_labels)
+        self.local      = threading.local()
+
+    #---------------------------------------------------#
+    #   与原先相同，字体大小为图片高度的3%
+    #---------------------------------------------------#
+    def font(self, height):
+        size = int(np.floor(3e-2 * height + 0.5))
+        if not hasattr(self.local, "fonts"):
+            self.local.fonts = {}
+        if size not in self.local.fonts:
+            self.local.fonts[size] = ImageFont.truetype(font=self.font_path, size=size)
+        return self.local.fonts[size]
+
+    def label_size(self, label, font):
+        key     = (font.size, label)
+        size    = self.sizes.get(key)
+        if size is None:
+            size = self.sizes.put(key, np.array(font.getsize(label)))
+        return size
+
+    #---------------------------------------------------#
+    #   标签底色与文字预先绘制成BGR的小图，用于cv2绘制
+    #---------------------------------------------------#
+    def sprite(self, c, label, font):
+        key     = (font.size, c, label)
+        sprite  = self.sprites.get(key)
+        if sprite is None:
+            label_size  = self.label_size(label, font)
+            image       = Image.new("RGB", tuple(label_size + 1), self.colors[c])
+            ImageDraw.Draw(image).text((0, 0), label, fill=(0, 0, 0), font=font)
+            sprite      = self.sprites.put(key, cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))
+        return sprite
+
+    #---------------------------------------------------#
+    #   标签放在框的上方，放不下时放在框内
+    #---------------------------------------------------#
+    def text_origin(self, top, left, label_size):
+        if top - label_size[1] >= 0:
+            return np.array([left, top - label_size[1]])
+        return np.array([left, top + 1])
+
+    #---------------------------------------------------#
+    #   在PIL图像上绘制，结果与原先逐框绘制完全相同
+    #   boxes为[N, 4]的top, left, bottom, right，classes为种类序号
+    #---------------------------------------------------#
+    def draw(self, image, boxes, classes, labels, thickness):
+        font = self.font(image.size[1])
+        draw = ImageDraw.Draw(image)
+        for (top, left, bottom, right), c, label in zip(boxes, classes, labels):
+            label_size  = self.label_size(label, font)
+            text_origin = self.text_origin(top, left, label_size)
+            for j in range(thickness):
+                draw.rectangle([left + j, top + j, right - j, bottom - j], outline=self.colors[c])
+            draw.rectangle([tuple(text_origin), tuple(text_origin + label_size)], fill=self.colors[c])
+            draw.text(text_origin, label, fill=(0, 0, 0), font=font)
+        del draw
+        return image
+
+    #---------------------------------------------------#
+    #   直接在BGR的numpy图像上绘制，省去与PIL之间的转换
+    #   框与PIL绘制的相同，标签直接贴上缓存的小图，
+    #   超出标签底色的笔画会被裁掉
+    #---------------------------------------------------#
+    def draw_bgr(self, frame, boxes, classes, labels, thickness):
+        height, width = frame.shape[:2]
+        font = self.font(height)
+        for (top, left, bottom, right), c, label in zip(boxes, classes, labels):
+            color       = self.colors[c][::-1]
+            label_size  = self.label_size(label, font)
+            x0, y0      = self.text_origin(top, left, label_size)
+            for j in range(thickness):
+                cv2.rectangle(frame, (int(left + j), int(top + j)), (int(right - j), int(bottom - j)), color, 1)
+            sprite      = self.sprite(c, label, font)
+            h, w        = min(sprite.shape[0], height - y0), min(sprite.shape[1], width - x0)
+            if h > 0 and w > 0:
+                frame[y0:y0 + h, x0:x0 + w] = sprite[:h, :w]
+        return frame
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class Detections(object):
+    #---------------------------------------------------#
+    #   一张图片的检测结果，所有字段都是连续的numpy数组
+    #   boxes       [N, 4] float32  top, left, bottom, right，原图坐标
+    #   scores      [N]    float32  obj_conf * class_conf
+    #   labels      [N]    int32    种类的序号
+    #   xyz         [N, 3] float32  左相机坐标系下框中心的三维坐标，单位m，
+    #                               没有计算深度时为None
+    #   valid_ratio [N]    float32  框内有效视差的比例，
+    #                               depth_stat为'center'或没有计算深度时为None
+    #   image_size  (w, h)          检测图片的大小，用于计算画框的像素坐标
+    #---------------------------------------------------#
+    __slots__ = ("boxes", "scores", "labels", "xyz", "valid_ratio", "class_names", "image_size")
+
+    def __init__(self, boxes, scores, labels, class_names, image_size, xyz = None, valid_ratio = None):
+        self.boxes          = np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores         = np.ascontiguousarray(scores, dtype=np.float32).reshape(-1)
+        self.labels         = np.ascontiguousarray(labels, dtype=np.int32).reshape(-1)
+        self.class_names    = class_names
+        self.image_size     = tuple(image_size)
+        self.xyz            = None if xyz is None else np.ascontiguousarray(xyz, dtype=np.float32).reshape(-1, 3)
+        self.valid_ratio    = None if valid_ratio is None else np.ascontiguousarray(valid_ratio, dtype=np.float32).reshape(-1)
+
+    #---------------------------------------------------#
+    #   由detect_batch返回的(top_label, top_conf, top_boxes)创建，
+    #   results为None时为空的结果
+    #---------------------------------------------------#
+    @classmethod
+    def from_results(cls, results, class_names, image_size):
+        if results is None:
+            return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), class_names, image_size)
+        top_label, top_conf, top_boxes = results
+        return cls(top_boxes, top_conf, top_label, class_names, image_size)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return "Detections(%d boxes, depth=%s)" % (len(self), self.xyz is not None)
+
+    #---------------------------------------------------#
+    #   与原先画框时相同的取整与裁剪，返回int32的top, left, bottom, right
+    #---------------------------------------------------#
+    @property
+    def pixel_boxes(self):
+        width, height = self.image_size
+        boxes   = np.floor(self.boxes).astype(np.int32)
+        return np.stack([np.maximum(boxes[:, 0], 0), np.maximum(boxes[:, 1], 0),
+                         np.minimum(boxes[:, 2], height), np.minimum(boxes[:, 3], width)], -1)
+
+    #---------------------------------------------------#
+    #   画框后的中心像素坐标x, y
+    #---------------------------------------------------#
+    @property
+    def centers(self):
+        boxes = self.pixel_boxes
+        return np.stack([(boxes[:, 1] + boxes[:, 3]) // 2, (boxes[:, 0] + boxes[:, 2]) // 2], -1)
+
+    #---------------------------------------------------#
+    #   到左相机光心的距离，单位m
+    #---------------------------------------------------#
+    @property
+    def distances(self):
+        if self.xyz is None:
+            return None
+        return np.sqrt(np.sum(self.xyz.astype(np.float64) ** 2, -1))
+
+    @property
+    def names(self):
+        return [self.class_names[int(c)] for c in self.labels]
+
+    #---------------------------------------------------#
+    #   每个种类的数量
+    #---------------------------------------------------#
+    def counts(self):
+        return np.bincount(self.labels, minlength=len(self.class_names))
+
+    #---------------------------------------------------#
+    #   转换为可以json序列化的列表
+    #   没有有效视差的框，三维坐标与距离中的inf与nan记为None
+    #---------------------------------------------------#
+    def to_list(self):
+        objects     = []
+        distances   = self.distances
+        for i in range(len(self)):
+            top, left, bottom, right = self.boxes[i].tolist()
+            obj = {
+                "label" : self.class_names[int(self.labels[i])],
+                "score" : float(self.scores[i]),
+                "box"   : [left, top, right, bottom],
+            }
+            if self.xyz is not None:
+                obj["xyz"]      = [v if np.isfinite(v) else None for v in self.xyz[i].tolist()]
+                obj["distance"] = float(distances[i]) if np.isfinite(distances[i]) else None
+            objects.append(obj)
+        return objects
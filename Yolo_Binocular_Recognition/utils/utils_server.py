@@ -0,0 +1,192 @@
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.utils_results import Detections
+
+
+class MicroBatcher(object):
+    #---------------------------------------------------#
+    #   动态批处理，把多个请求的图片合成一个batch进行预测
+    #   detect_batch    接收图片列表，返回与之对应的结果列表
+    #   max_batch_size  一个batch最多的图片数
+    #   max_latency     第一张图片进入队列后最多等待的秒数，
+    #                   等待期间到达的图片放入同一个batch
+    #
+    #   只有一个线程调用detect_batch，网络只加载一份
+    #---------------------------------------------------#
+    def __init__(self, detect_batch, max_batch_size = 8, max_latency = 0.005):
+        self.detect_batch   = detect_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency    = max_latency
+        self.queue          = queue.Queue()
+        self.stop_event     = threading.Event()
+        self.lock           = threading.Lock()
+        self.num_batches    = 0
+        self.num_images     = 0
+        self.thread         = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    #---------------------------------------------------#
+    #   取出第一张图片后，在max_latency内尽量凑满batch
+    #---------------------------------------------------#
+    def collect(self):
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.collect()
+            if len(batch) == 0:
+                continue
+            try:
+                results = self.detect_batch([image for image, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            with self.lock:
+                self.num_batches    += 1
+                self.num_images     += len(batch)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches"           : self.num_batches,
+                "images"            : self.num_images,
+                "mean_batch_size"   : self.num_images / self.num_batches if self.num_batches > 0 else 0.0,
+            }
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+class InferenceService(object):
+    #---------------------------------------------------#
+    #   一个YOLO对象服务多个请求
+    #   网络预测由MicroBatcher合批完成，
+    #   双目校正与视差在请求线程中与网络预测同时进行
+    #   SGBM匹配器不能在多个线程中同时使用，
+    #   因此准备depth_workers个StereoDepthEngine副本轮流使用，
+    #   同时也限制了同时计算视差的请求数
+    #---------------------------------------------------#
+    def __init__(self, yolo, max_batch_size = 8, max_latency = 0.005, depth_workers = 2):
+        self.yolo       = yolo
+        self.batcher    = MicroBatcher(yolo.detect_batch, max_batch_size, max_latency)
+        self.stereos    = queue.Queue()
+        for _ in range(depth_workers):
+            self.stereos.put(yolo.stereo.clone())
+
+    #---------------------------------------------------#
+    #   image为左右拼接的双目图片，返回Detections
+    #---------------------------------------------------#
+    def predict(self, image, depth = True):
+        left    = self.yolo.crop_left(image)
+        future  = self.batcher.submit(left)
+        if not depth:
+            return Detections.from_results(future.result(), self.yolo.class_names, left.size)
+
+        stereo  = self.stereos.get()
+        try:
+            frame = cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+            img1_rectified, img2_rectified = stereo.rectify(frame)
+            disparity = None
+            if self.yolo.depth_mode != "roi":
+                disparity = stereo.compute(img1_rectified, img2_rectified)
+            detections = Detections.from_results(future.result(), self.yolo.class_names, left.size)
+            return self.yolo.measure_depth(detections, img1_rectified, img2_rectified, disparity, stereo=stereo)
+        finally:
+            self.stereos.put(stereo)
+
+    def close(self):
+        self.batcher.close()
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    #---------------------------------------------------#
+    #   POST /predict?depth=1   请求体为图片文件的字节，返回json的检测结果
+    #   GET  /health            服务是否可用
+    #   GET  /stats             合批的统计信息
+    #---------------------------------------------------#
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif path == "/stats":
+            self.send_json(200, self.server.service.batcher.stats())
+        else:
+            self.send_json(404, {"error": "Unknown path %s" % path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self.send_json(404, {"error": "Unknown path %s" % url.path})
+            return
+        depth = parse_qs(url.query).get("depth", ["1"])[0] not in ("0", "false", "False")
+        try:
+            body    = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            image   = Image.open(io.BytesIO(body))
+            image.load()
+        except (OSError, ValueError) as e:
+            self.send_json(400, {"error": "Cannot read image: %s" % e})
+            return
+
+        start_time  = time.time()
+        try:
+            detections = self.server.service.predict(image, depth)
+        except Exception as e:
+            self.send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+        self.send_json(200, {
+            "image_size"    : list(detections.image_size),
+            "detections"    : detections.to_list(),
+            "latency_ms"    : (time.time() - start_time) * 1000,
+        })
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host = "127.0.0.1", port = 8000, verbose = False):
+        ThreadingHTTPServer.__init__(self, (host, port), InferenceHandler)
+        self.service = service
+        self.verbose = verbose
@@ -0,0 +1,169 @@
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+RING_MAGIC  = 0x594F4C4F52494E47
+#---------------------------------------------------#
+#   共享内存的布局
+#   ring头     magic, num_slots, slot_bytes, latest_id
+#   slot头     每个slot一个，seq, frame_id, timestamp, shape
+#   数据       num_slots * slot_bytes，每个slot按64字节对齐
+#---------------------------------------------------#
+RING_HEADER = np.dtype([("magic", "<u8"), ("num_slots", "<i8"), ("slot_bytes", "<i8"), ("latest_id", "<i8")])
+SLOT_HEADER = np.dtype([("seq", "<i8"), ("frame_id", "<i8"), ("timestamp", "<f8"), ("shape", "<i8", (3,))])
+
+def align(n, alignment = 64):
+    return (n + alignment - 1) // alignment * alignment
+
+
+class SharedFrame(object):
+    #---------------------------------------------------#
+    #   共享内存中的一帧，array直接指向共享内存，没有复制
+    #   写入端不会等待读取端，读取端处理得慢时slot会被新的帧覆盖，
+    #   使用完array之后调用valid()确认这一帧在使用期间没有被覆盖
+    #---------------------------------------------------#
+    __slots__ = ("ring", "slot", "seq", "frame_id", "timestamp", "array")
+
+    def __init__(self, ring, slot, seq, frame_id, timestamp, array):
+        self.ring       = ring
+        self.slot       = slot
+        self.seq        = seq
+        self.frame_id   = frame_id
+        self.timestamp  = timestamp
+        self.array      = array
+
+    def valid(self):
+        return int(self.ring.slots["seq"][self.slot]) == self.seq
+
+    #---------------------------------------------------#
+    #   需要长期保存这一帧时复制出来，被覆盖时返回None
+    #---------------------------------------------------#
+    def copy(self):
+        array = self.array.copy()
+        return array if self.valid() else None
+
+
+class SharedFrameRing(object):
+    #---------------------------------------------------#
+    #   基于multiprocessing.shared_memory的帧环形缓冲区
+    #   一个写入进程（如读取摄像头的进程），任意多个读取进程（如检测进程）
+    #   帧只在写入时复制一次，读取端直接在共享内存上做预处理，
+    #   不再需要pickle与进程间的管道传输
+    #
+    #   每个slot用seq做顺序锁：写入前seq加1变为奇数，写完再加1变为偶数，
+    #   读取端在读取前后比较seq，即可发现读到一半被覆盖的帧
+    #   创建：SharedFrameRing.create(name, num_slots, max_shape)
+    #   连接：SharedFrameRing.attach(name)
+    #---------------------------------------------------#
+    def __init__(self, shm, owner):
+        self.shm        = shm
+        self.owner      = owner
+        self.header     = np.ndarray((), RING_HEADER, buffer=shm.buf, offset=0)
+        if int(self.header["magic"]) != RING_MAGIC:
+            raise ValueError("共享内存%s不是SharedFrameRing。" % shm.name)
+        self.num_slots  = int(self.header["num_slots"])
+        self.slot_bytes = int(self.header["slot_bytes"])
+        data_offset     = align(RING_HEADER.itemsize + SLOT_HEADER.itemsize * self.num_slots)
+        self.slots      = np.ndarray((self.num_slots,), SLOT_HEADER, buffer=shm.buf, offset=RING_HEADER.itemsize)
+        self.data       = np.ndarray((self.num_slots, self.slot_bytes), np.uint8, buffer=shm.buf, offset=data_offset)
+
+    @classmethod
+    def create(cls, name, num_slots, max_shape):
+        slot_bytes  = align(int(np.prod(max_shape)))
+        size        = align(RING_HEADER.itemsize + SLOT_HEADER.itemsize * num_slots) + slot_bytes * num_slots
+        shm         = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header      = np.ndarray((), RING_HEADER, buffer=shm.buf, offset=0)
+        header["num_slots"], header["slot_bytes"], header["latest_id"] = num_slots, slot_bytes, -1
+        slots       = np.ndarray((num_slots,), SLOT_HEADER, buffer=shm.buf, offset=RING_HEADER.itemsize)
+        slots["seq"], slots["frame_id"] = 0, -1
+        header["magic"] = RING_MAGIC
+        del header, slots
+        return cls(shm, owner=True)
+
+    #---------------------------------------------------#
+    #   连接已有的缓冲区
+    #   python3.13之前连接的进程退出时resource_tracker会删除共享内存，
+    #   因此只由创建者负责删除
+    #---------------------------------------------------#
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    def latest_id(self):
+        return int(self.header["latest_id"])
+
+    #---------------------------------------------------#
+    #   写入一帧，frame为uint8的[h, w, c]或[h, w]，返回帧序号
+    #---------------------------------------------------#
+    def write(self, frame, timestamp = None):
+        frame = np.asarray(frame, dtype=np.uint8)
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError("Frame of shape %s is larger than the slot size %d." % (frame.shape, self.slot_bytes))
+        frame_id    = self.latest_id() + 1
+        slot        = frame_id % self.num_slots
+        header      = self.slots[slot]
+        shape       = frame.shape + (1,) * (3 - frame.ndim)
+
+        header["seq"]       += 1
+        header["frame_id"]  = frame_id
+        header["timestamp"] = time.time() if timestamp is None else timestamp
+        header["shape"]     = shape
+        self.data[slot, :frame.nbytes].reshape(frame.shape)[...] = frame
+        header["seq"]       += 1
+        self.header["latest_id"] = frame_id
+        return frame_id
+
+    #---------------------------------------------------#
+    #   读取指定序号的帧，还没有写入或已经被覆盖时返回None
+    #---------------------------------------------------#
+    def get(self, frame_id):
+        if frame_id < 0:
+            return None
+        slot    = frame_id % self.num_slots
+        header  = self.slots[slot]
+        seq     = int(header["seq"])
+        if seq % 2 == 1 or int(header["frame_id"]) != frame_id:
+            return None
+        shape       = tuple(int(v) for v in header["shape"])
+        timestamp   = float(header["timestamp"])
+        array       = self.data[slot, :int(np.prod(shape))].reshape(shape)
+        if shape[2] == 1:
+            array   = array[..., 0]
+        frame       = SharedFrame(self, slot, seq, frame_id, timestamp, array)
+        return frame if frame.valid() else None
+
+    #---------------------------------------------------#
+    #   等待序号大于last_id的最新一帧
+    #   多个检测进程分担同一个缓冲区时，
+    #   第rank个进程只处理frame_id % world == rank的帧
+    #   超过timeout秒没有新的帧时返回None
+    #---------------------------------------------------#
+    def next_frame(self, last_id = -1, rank = 0, world = 1, timeout = None, interval = 0.001):
+        start_time = time.time()
+        while True:
+            latest      = self.latest_id()
+            frame_id    = latest - (latest - rank) % world
+            if frame_id > last_id:
+                frame = self.get(frame_id)
+                if frame is not None:
+                    return frame
+            if timeout is not None and time.time() - start_time > timeout:
+                return None
+            time.sleep(interval)
+
+    #---------------------------------------------------#
+    #   关闭前需要释放所有指向共享内存的array
+    #---------------------------------------------------#
+    def close(self):
+        self.header = self.slots = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
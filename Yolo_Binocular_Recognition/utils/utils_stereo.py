@@ -0,0 +1,527 @@
+import copy
+import os
+import struct
+import zipfile
+
+import cv2
+import numpy as np
+
+#---------------------------------------------------#
+#   reprojectImageTo3D对缺失点使用的Z值
+#---------------------------------------------------#
+MISSING_Z = 10000
+
+#---------------------------------------------------#
+#   可选的SGBM模式，HH最慢也最精确
+#---------------------------------------------------#
+SGBM_MODES = {
+    "SGBM"  : cv2.STEREO_SGBM_MODE_SGBM,
+    "HH"    : cv2.STEREO_SGBM_MODE_HH,
+    "3WAY"  : cv2.STEREO_SGBM_MODE_SGBM_3WAY,
+    "HH4"   : cv2.STEREO_SGBM_MODE_HH4,
+}
+
+
+#---------------------------------------------------#
+#   用Q矩阵把像素坐标与视差投影为三维坐标
+#   x, y, d可以是标量也可以是数组，d为int16视差（真实视差的16倍）
+#   运算顺序与reprojectImageTo3D保持一致，乘16后结果完全相同
+#---------------------------------------------------#
+def project_points(Q, x, y, d):
+    v   = [np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(d, dtype=np.float64), 1.]
+    #---------------------------------------------------#
+    #   先用双精度求齐次坐标并转为单精度，
+    #   再用双精度乘以1 / W，与OpenCV 4的实现一致
+    #---------------------------------------------------#
+    homg = [((Q[i, 0] * v[0] + Q[i, 1] * v[1]) + Q[i, 2] * v[2]) + Q[i, 3] * v[3] for i in range(4)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xyz = np.stack(homg[:3], -1).astype(np.float32).astype(np.float64)
+        xyz = (xyz * (1. / homg[3])[..., None]).astype(np.float32)
+    return xyz * np.float32(16)
+
+#---------------------------------------------------#
+#   统计每个目标框内的视差
+#   boxes为[N, 4]的top, left, bottom, right，坐标相对整幅图
+#   offset为disparity左上角在整幅图中的坐标(x, y)
+#   method为'median'时取中值，为'trimmed'时去掉两端各trim比例后取均值
+#   返回每个框的视差（无有效点时为nan）与有效点比例
+#
+#   所有框内的像素一次取出，用一次bincount统计每个框的视差直方图，
+#   中值与去尾均值都由直方图的累计个数直接求出，不需要逐框排序
+#---------------------------------------------------#
+def box_disparity(disparity, boxes, offset = (0, 0), method = "median", trim = 0.1, min_disparity = 1):
+    boxes       = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    boxes       = boxes - np.array([offset[1], offset[0], offset[1], offset[0]])
+    height, width = disparity.shape[:2]
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, height - 1)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, width - 1)
+
+    values      = np.full(len(boxes), np.nan, dtype=np.float32)
+    valid_ratio = np.zeros(len(boxes), dtype=np.float32)
+    box_size    = np.maximum(boxes[:, 2] - boxes[:, 0] + 1, 0) * np.maximum(boxes[:, 3] - boxes[:, 1] + 1, 0)
+    if box_size.sum() == 0:
+        return values, valid_ratio
+
+    #---------------------------------------------------#
+    #   所有框内的像素拼成一维，index为每个像素所属的框
+    #   切片拼接只是内存复制，比逐像素的高级索引快得多
+    #---------------------------------------------------#
+    index       = np.repeat(np.arange(len(boxes)), box_size)
+    pixels      = np.concatenate([disparity[top:bottom + 1, left:right + 1].ravel() for top, left, bottom, right in boxes])
+
+    #---------------------------------------------------#
+    #   hist[i, v]为第i个框内视差等于low + v的像素个数
+    #   无效视差统一放在多出来的第0列，统计后丢弃
+    #---------------------------------------------------#
+    low         = min_disparity * 16
+    num_bins    = max(int(pixels.max()) - low + 1, 1)
+    bin_index   = np.maximum(pixels.astype(np.int64) - (low - 1), 0)
+    hist        = np.bincount(index * (num_bins + 1) + bin_index, minlength=len(boxes) * (num_bins + 1))
+    hist        = hist.reshape(len(boxes), num_bins + 1)[:, 1:]
+    counts      = hist.sum(1)
+    has_valid   = counts > 0
+    if not has_valid.any():
+        return values, valid_ratio
+    valid_ratio[has_valid] = counts[has_valid] / box_size[has_valid]
+
+    #---------------------------------------------------#
+    #   累计个数与累计视差之和，前面补0
+    #   第r个（从0开始）视差所在的取值为累计个数超过r的第一个取值
+    #---------------------------------------------------#
+    hist        = hist[has_valid]
+    counts      = counts[has_valid]
+    rows        = np.arange(len(hist))
+    bins        = np.arange(low, low + num_bins + 1)
+    cum_count   = np.concatenate([np.zeros((len(hist), 1), np.int64), np.cumsum(hist, 1)], 1)
+    cum_sum     = np.concatenate([np.zeros((len(hist), 1), np.int64), np.cumsum(hist * bins[:-1], 1)], 1)
+
+    def rank_bin(r):
+        return (cum_count[:, 1:] <= r[:, None]).sum(1)
+
+    if method == "trimmed":
+        #---------------------------------------------------#
+        #   排序后前r个视差之和
+        #---------------------------------------------------#
+        def rank_sum(r):
+            v = rank_bin(r)
+            return cum_sum[rows, v] + (r - cum_count[rows, v]) * bins[v]
+        k       = (counts * trim).astype(np.int64)
+        values[has_valid] = (rank_sum(counts - k) - rank_sum(k)) / (counts - 2 * k)
+    else:
+        #---------------------------------------------------#
+        #   个数为偶数时与np.median一样取中间两个的均值
+        #---------------------------------------------------#
+        values[has_valid] = (bins[rank_bin((counts - 1) // 2)] + bins[rank_bin(counts // 2)]) / 2.0
+    return values, valid_ratio
+
+#---------------------------------------------------#
+#   根据相机标定结果计算极线校正参数与映射表
+#   返回的字典即为标定文件中保存的全部内容
+#---------------------------------------------------#
+def create_calibration(left_camera_matrix, left_distortion, right_camera_matrix, right_distortion, R, T, size):
+    R1, R2, P1, P2, Q, validPixROI1, validPixROI2 = cv2.stereoRectify(
+        left_camera_matrix, left_distortion, right_camera_matrix, right_distortion, tuple(size), R, T
+    )
+    left_map1, left_map2    = cv2.initUndistortRectifyMap(left_camera_matrix, left_distortion, R1, P1, tuple(size), cv2.CV_16SC2)
+    right_map1, right_map2  = cv2.initUndistortRectifyMap(right_camera_matrix, right_distortion, R2, P2, tuple(size), cv2.CV_16SC2)
+    return {
+        "left_camera_matrix"    : np.asarray(left_camera_matrix, dtype=np.float64),
+        "left_distortion"       : np.asarray(left_distortion, dtype=np.float64),
+        "right_camera_matrix"   : np.asarray(right_camera_matrix, dtype=np.float64),
+        "right_distortion"      : np.asarray(right_distortion, dtype=np.float64),
+        "R"                     : np.asarray(R, dtype=np.float64),
+        "T"                     : np.asarray(T, dtype=np.float64),
+        "size"                  : np.asarray(size, dtype=np.int32),
+        "R1"                    : R1,
+        "R2"                    : R2,
+        "P1"                    : P1,
+        "P2"                    : P2,
+        "Q"                     : Q,
+        "left_map1"             : left_map1,
+        "left_map2"             : left_map2,
+        "right_map1"            : right_map1,
+        "right_map2"            : right_map2,
+    }
+
+#---------------------------------------------------#
+#   保存为一个不压缩的npz文件，方便读取时直接内存映射
+#---------------------------------------------------#
+def save_calibration(calib_path, calib):
+    calib_dir = os.path.dirname(calib_path)
+    if calib_dir and not os.path.exists(calib_dir):
+        os.makedirs(calib_dir)
+    with open(calib_path, "wb") as f:
+        np.savez(f, **calib)
+
+#---------------------------------------------------#
+#   读取标定文件
+#   mmap_mode不为None时，未压缩的数组直接映射到文件上，
+#   映射表不需要读入内存也不需要重新计算
+#---------------------------------------------------#
+def load_calibration(calib_path, mmap_mode = "r"):
+    if mmap_mode is None:
+        with np.load(calib_path) as data:
+            return {key: data[key] for key in data.files}
+
+    calib = {}
+    with zipfile.ZipFile(calib_path) as zf, open(calib_path, "rb") as f:
+        for info in zf.infolist():
+            key = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    calib[key] = np.lib.format.read_array(member)
+                continue
+            #---------------------------------------------------#
+            #   跳过zip的本地文件头与npy的文件头，得到数据的偏移
+            #---------------------------------------------------#
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            calib[key] = np.memmap(calib_path, dtype=dtype, mode=mmap_mode, offset=f.tell(), shape=shape,
+                                   order="F" if fortran_order else "C")
+    return calib
+
+
+class StereoDepthEngine(object):
+    #---------------------------------------------------#
+    #   双目深度计算引擎
+    #   持有校正映射表与唯一的SGBM匹配器，
+    #   只有numDisparities或blockSize变化时才重建匹配器
+    #
+    #   scale小于1时校正后的图像先缩小再计算视差，
+    #   视差图上的坐标称为网格坐标，Q也相应地换算到网格上；
+    #   对外的接口仍然使用原图坐标，内部再换算到网格
+    #   mode可以是SGBM_MODES中的名字，也可以直接是OpenCV的常量
+    #---------------------------------------------------#
+    def __init__(self, left_map1, left_map2, right_map1, right_map2, Q, num = 6, block_size = 10,
+                 min_disparity = 1, mode = "HH", scale = 1):
+        self.left_map1      = left_map1
+        self.left_map2      = left_map2
+        self.right_map1     = right_map1
+        self.right_map2     = right_map2
+        self.Q              = Q
+        self.min_disparity  = min_disparity
+        self.mode           = SGBM_MODES.get(mode, mode)
+        self.scale          = scale
+        #---------------------------------------------------#
+        #   网格像素(x, y)的中心对应原图的(x + 0.5) / scale - 0.5，
+        #   网格上的视差也要除以scale
+        #---------------------------------------------------#
+        if self.scale == 1:
+            self.disparity_Q = self.Q
+        else:
+            c = 0.5 / self.scale - 0.5
+            A = np.array([
+                [1 / self.scale, 0, 0, c],
+                [0, 1 / self.scale, 0, c],
+                [0, 0, 1 / self.scale, 0],
+                [0, 0, 0, 1],
+            ])
+            self.disparity_Q = np.dot(self.Q, A)
+
+        self.num_disparities    = None
+        self.block_size         = None
+        self.stereo             = None
+        self.set_params(num, block_size)
+
+    @classmethod
+    def from_calibration(cls, calib, **kwargs):
+        return cls(calib["left_map1"], calib["left_map2"], calib["right_map1"], calib["right_map2"],
+                   np.asarray(calib["Q"]), **kwargs)
+
+    #---------------------------------------------------#
+    #   复制一个引擎，校正映射表与Q共用，SGBM匹配器单独创建
+    #   一个匹配器同一时间只能在一个线程中计算视差，
+    #   多个线程同时计算时每个线程使用自己的副本
+    #---------------------------------------------------#
+    def clone(self):
+        engine          = copy.copy(self)
+        engine.stereo   = engine.create_matcher()
+        return engine
+
+    #---------------------------------------------------#
+    #   设置视差参数，num对应numDisparities / 16
+    #   blockSize必须为不小于5的奇数
+    #---------------------------------------------------#
+    def set_params(self, num = None, block_size = None):
+        num_disparities = self.num_disparities if num is None else 16 * max(int(num), 1)
+        if block_size is None:
+            block_size = self.block_size
+        else:
+            block_size = int(block_size)
+            if block_size % 2 == 0:
+                block_size += 1
+            if block_size < 5:
+                block_size = 5
+
+        if self.stereo is not None and num_disparities == self.num_disparities and block_size == self.block_size:
+            return False
+        self.num_disparities    = num_disparities
+        self.block_size         = block_size
+        self.stereo             = self.create_matcher()
+        return True
+
+    #---------------------------------------------------#
+    #   网格上的视差搜索范围，缩小后仍需为16的倍数
+    #---------------------------------------------------#
+    @property
+    def search_disparities(self):
+        if self.scale == 1:
+            return self.num_disparities
+        return max(int(np.ceil(self.num_disparities * self.scale / 16)) * 16, 16)
+
+    def create_matcher(self):
+        img_channels = 3
+        return cv2.StereoSGBM_create(
+            minDisparity        = self.min_disparity,
+            numDisparities      = self.search_disparities,
+            blockSize           = self.block_size,
+            P1                  = 8 * img_channels * self.block_size * self.block_size,
+            P2                  = 32 * img_channels * self.block_size * self.block_size,
+            disp12MaxDiff       = -1,
+            preFilterCap        = 1,
+            uniquenessRatio     = 10,
+            speckleWindowSize   = 100,
+            speckleRange        = 100,
+            mode                = self.mode,
+        )
+
+    #---------------------------------------------------#
+    #   将左右拼接的BGR图像拆分、转灰度并进行极线校正
+    #---------------------------------------------------#
+    def rectify(self, frame):
+        height, width = frame.shape[:2]
+        half    = width // 2
+        imgL    = cv2.cvtColor(frame[:, :half], cv2.COLOR_BGR2GRAY)
+        imgR    = cv2.cvtColor(frame[:, half:half * 2], cv2.COLOR_BGR2GRAY)
+
+        img1_rectified = cv2.remap(imgL, self.left_map1, self.left_map2, cv2.INTER_LINEAR)
+        img2_rectified = cv2.remap(imgR, self.right_map1, self.right_map2, cv2.INTER_LINEAR)
+        if self.scale != 1:
+            grid_size       = (int(round(img1_rectified.shape[1] * self.scale)), int(round(img1_rectified.shape[0] * self.scale)))
+            img1_rectified  = cv2.resize(img1_rectified, grid_size, interpolation=cv2.INTER_AREA)
+            img2_rectified  = cv2.resize(img2_rectified, grid_size, interpolation=cv2.INTER_AREA)
+        return img1_rectified, img2_rectified
+
+    #---------------------------------------------------#
+    #   原图上的像素坐标换算为网格坐标
+    #---------------------------------------------------#
+    def to_grid(self, coords):
+        coords = np.asarray(coords, dtype=np.int64)
+        if self.scale == 1:
+            return coords
+        return np.floor(coords * self.scale).astype(np.int64)
+
+    #---------------------------------------------------#
+    #   计算视差，返回值为int16，数值为网格上真实视差的16倍
+    #---------------------------------------------------#
+    def compute(self, img1_rectified, img2_rectified):
+        return self.stereo.compute(img1_rectified, img2_rectified)
+
+    #---------------------------------------------------#
+    #   全图三维重建，与原先的做法一致
+    #   reprojectImageTo3D把int16视差当作整数处理，需要乘16
+    #---------------------------------------------------#
+    def reproject(self, disparity):
+        threeD = cv2.reprojectImageTo3D(disparity, self.disparity_Q, handleMissingValues=True)
+        return threeD * 16
+
+    #---------------------------------------------------#
+    #   计算目标框对应区域在校正图像上的搜索窗口
+    #   左侧向外扩展视差搜索范围，上下左右扩展半个匹配块
+    #   box为网格坐标下的top, left, bottom, right
+    #---------------------------------------------------#
+    def roi_window(self, box, image_shape):
+        height, width   = image_shape[:2]
+        top, left, bottom, right = [int(v) for v in box]
+        margin  = self.block_size // 2 + 1
+        search  = self.min_disparity + self.search_disparities
+
+        y0      = max(top - margin, 0)
+        y1      = min(bottom + margin + 1, height)
+        x0      = max(left - search - margin, 0)
+        x1      = min(right + margin + 1, width)
+        #---------------------------------------------------#
+        #   SGBM要求窗口宽度大于搜索范围加半个匹配块
+        #   靠近左边界时向右补足
+        #---------------------------------------------------#
+        min_width = search + margin * 2 + 1
+        if x1 - x0 < min_width:
+            x1  = min(x0 + min_width, width)
+            x0  = max(x1 - min_width, 0)
+        return y0, y1, x0, x1
+
+    #---------------------------------------------------#
+    #   只在目标框附近计算视差，box为原图坐标
+    #   返回目标框内的视差，以及它左上角的网格坐标
+    #---------------------------------------------------#
+    def compute_roi(self, img1_rectified, img2_rectified, box):
+        height, width   = img1_rectified.shape[:2]
+        top, left, bottom, right = [int(v) for v in self.to_grid(box)]
+        top, left       = min(max(top, 0), height - 1), min(max(left, 0), width - 1)
+        bottom, right   = min(max(bottom, top), height - 1), min(max(right, left), width - 1)
+
+        y0, y1, x0, x1  = self.roi_window((top, left, bottom, right), img1_rectified.shape)
+        disparity       = self.stereo.compute(
+            np.ascontiguousarray(img1_rectified[y0:y1, x0:x1]),
+            np.ascontiguousarray(img2_rectified[y0:y1, x0:x1]),
+        )
+        return disparity[top - y0:bottom - y0 + 1, left - x0:right - x0 + 1], (left, top)
+
+    #---------------------------------------------------#
+    #   只对需要的像素用Q求三维坐标，不再生成整幅点云
+    #   points为[N, 2]的(x, y)，坐标相对整幅原图
+    #   offset为disparity左上角的网格坐标(x, y)
+    #   视差不大于missing的点视为缺失，Z设为10000 * 16，
+    #   missing默认取disparity的最小值，与handleMissingValues=True一致
+    #---------------------------------------------------#
+    def lookup_xyz(self, disparity, points, offset = (0, 0), missing = None):
+        points  = self.to_grid(np.asarray(points, dtype=np.int64).reshape(-1, 2))
+        #---------------------------------------------------#
+        #   贴着图像下边界或右边界的框，中心可能刚好落在图像外
+        #---------------------------------------------------#
+        height, width = disparity.shape[:2]
+        points  = np.stack([np.clip(points[:, 0], offset[0], offset[0] + width - 1),
+                            np.clip(points[:, 1], offset[1], offset[1] + height - 1)], -1)
+        d       = disparity[points[:, 1] - offset[1], points[:, 0] - offset[0]]
+        if missing is None:
+            missing = disparity.min()
+        xyz     = project_points(self.disparity_Q, points[:, 0], points[:, 1], d)
+        xyz[d <= missing, 2] = MISSING_Z * 16
+        return xyz
+
+    #---------------------------------------------------#
+    #   用框内视差的统计值估计框中心的三维坐标
+    #   boxes为原图坐标，offset为网格坐标
+    #   没有有效视差的框与缺失点一样，Z为10000 * 16
+    #---------------------------------------------------#
+    def box_xyz(self, disparity, boxes, offset = (0, 0), method = "median", trim = 0.1):
+        boxes       = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        values, valid_ratio = box_disparity(disparity, self.to_grid(boxes), offset, method, trim, self.min_disparity)
+        middle_x    = self.to_grid(np.floor((boxes[:, 1] + boxes[:, 3]) / 2))
+        middle_y    = self.to_grid(np.floor((boxes[:, 0] + boxes[:, 2]) / 2))
+        xyz         = project_points(self.disparity_Q, middle_x, middle_y, np.nan_to_num(values))
+        xyz[np.isnan(values), 2] = MISSING_Z * 16
+        return xyz, valid_ratio
+
+
+
+class TemporalDisparity(object):
+    #---------------------------------------------------#
+    #   静止场景下的增量视差
+    #   把校正图像分成tile_size大小的块，与缓存的图像做帧差，
+    #   只在变化的块上重新计算视差，其余块沿用缓存
+    #
+    #   diff_threshold      块内灰度差的最大值超过该值时认为发生变化
+    #   refresh_interval    每隔多少帧重新计算一次整幅视差，防止误差累积
+    #   max_changed_ratio   变化的块超过该比例时直接计算整幅视差
+    #---------------------------------------------------#
+    def __init__(self, engine, tile_size = 64, diff_threshold = 12, refresh_interval = 30, max_changed_ratio = 0.5):
+        self.engine             = engine
+        self.tile_size          = tile_size
+        self.diff_threshold     = diff_threshold
+        self.refresh_interval   = refresh_interval
+        self.max_changed_ratio  = max_changed_ratio
+        self.reset()
+
+    def reset(self):
+        self.img1_cache     = None
+        self.img2_cache     = None
+        self.disparity      = None
+        self.params         = None
+        self.frames         = 0
+        self.changed_ratio  = 1.0
+
+    def __call__(self, img1_rectified, img2_rectified):
+        return self.compute(img1_rectified, img2_rectified)
+
+    #---------------------------------------------------#
+    #   每个块内的最大灰度差，图像尺寸不是块的整数倍时补0
+    #---------------------------------------------------#
+    def tile_diff(self, img1_rectified, img2_rectified):
+        diff    = cv2.max(cv2.absdiff(img1_rectified, self.img1_cache), cv2.absdiff(img2_rectified, self.img2_cache))
+        height, width = diff.shape[:2]
+        t       = self.tile_size
+        th, tw  = -(-height // t), -(-width // t)
+        diff    = np.pad(diff, ((0, th * t - height), (0, tw * t - width)))
+        return diff.reshape(th, t, tw, t).max(axis=(1, 3))
+
+    def compute_full(self, img1_rectified, img2_rectified):
+        self.img1_cache     = img1_rectified.copy()
+        self.img2_cache     = img2_rectified.copy()
+        self.disparity      = self.engine.compute(img1_rectified, img2_rectified)
+        self.params         = (self.engine.num_disparities, self.engine.block_size)
+        self.frames         = 0
+        self.changed_ratio  = 1.0
+        return self.disparity.copy()
+
+    def compute(self, img1_rectified, img2_rectified):
+        if self.disparity is None or self.img1_cache.shape != img1_rectified.shape \
+                or self.params != (self.engine.num_disparities, self.engine.block_size) \
+                or self.frames + 1 >= self.refresh_interval:
+            return self.compute_full(img1_rectified, img2_rectified)
+        self.frames += 1
+
+        t       = self.tile_size
+        changed = (self.tile_diff(img1_rectified, img2_rectified) > self.diff_threshold).astype(np.uint8)
+        #---------------------------------------------------#
+        #   右图x处的变化会影响左图x到x + 搜索范围的匹配，
+        #   因此变化区域向右扩展搜索范围，四周再扩展一块作为匹配块的边缘
+        #---------------------------------------------------#
+        search  = -(-(self.engine.min_disparity + self.engine.search_disparities) // t)
+        changed = cv2.dilate(changed, np.ones((3, search + 3), np.uint8), anchor=(search + 1, 1))
+        self.changed_ratio = float(changed.mean())
+        if self.changed_ratio == 0:
+            return self.disparity.copy()
+        if self.changed_ratio > self.max_changed_ratio:
+            return self.compute_full(img1_rectified, img2_rectified)
+
+        #---------------------------------------------------#
+        #   相连的变化块合并为一个矩形，每个矩形计算一次视差
+        #---------------------------------------------------#
+        height, width = img1_rectified.shape[:2]
+        _, _, stats, _ = cv2.connectedComponentsWithStats(changed, connectivity=8)
+        for x, y, w, h, _ in stats[1:]:
+            top, left       = y * t, x * t
+            bottom, right   = min((y + h) * t, height) - 1, min((x + w) * t, width) - 1
+            y0, y1, x0, x1  = self.engine.roi_window((top, left, bottom, right), img1_rectified.shape)
+            disparity       = self.engine.stereo.compute(
+                np.ascontiguousarray(img1_rectified[y0:y1, x0:x1]),
+                np.ascontiguousarray(img2_rectified[y0:y1, x0:x1]),
+            )
+            self.disparity[top:bottom + 1, left:right + 1]  = disparity[top - y0:bottom - y0 + 1, left - x0:right - x0 + 1]
+            self.img1_cache[top:bottom + 1, left:right + 1] = img1_rectified[top:bottom + 1, left:right + 1]
+            self.img2_cache[top:bottom + 1, left:right + 1] = img2_rectified[top:bottom + 1, left:right + 1]
+        return self.disparity.copy()
+
+
+#---------------------------------------------------#
+#   把视差归一化到0~255，用于显示
+#---------------------------------------------------#
+def disparity_to_image(disparity):
+    return cv2.normalize(disparity, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+
+class DisparityWindow(object):
+    #---------------------------------------------------#
+    #   显示视差图的可选输出，只有需要界面时才创建窗口
+    #   传入engine时附带num与blockSize两个滑动条，
+    #   每次显示时把滑动条的数值同步给engine
+    #---------------------------------------------------#
+    def __init__(self, win_name = "depth", engine = None):
+        self.win_name   = win_name
+        self.engine     = engine
+        cv2.namedWindow(self.win_name, cv2.WINDOW_AUTOSIZE)
+        if self.engine is not None:
+            cv2.createTrackbar("num", self.win_name, self.engine.num_disparities // 16, 10, lambda x: None)
+            cv2.createTrackbar("blockSize", self.win_name, self.engine.block_size, 25, lambda x: None)
+
+    def __call__(self, disparity):
+        cv2.imshow(self.win_name, disparity_to_image(disparity))
+        if self.engine is not None:
+            self.engine.set_params(cv2.getTrackbarPos("num", self.win_name), cv2.getTrackbarPos("blockSize", self.win_name))
@@ -1,14 +1,11 @@
 import json
 import os
 
-import numpy as np
-import torch
 from PIL import Image
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
 from tqdm import tqdm
 
-from utils.utils import cvtColor, preprocess_input, resize_image
 from yolo import YOLO
 
 #---------------------------------------------------------------------------#
@@ -27,62 +24,37 @@ dataset_img_path    = 'coco_dataset/val2017'
 #   结果输出的文件夹，默认为map_out
 #-------------------------------------------------------#
 temp_save_path      = 'map_out/coco_eval'
+#-------------------------------------------------------#
+#   每次送入网络的图片数量，显存不足时调小
+#-------------------------------------------------------#
+batch_size          = 16
 
 class mAP_YOLO(YOLO):
     #---------------------------------------------------#
     #   检测图片
     #---------------------------------------------------#
     def detect_image(self, image_id, image, results, clsid2catid):
-        #---------------------------------------------------#
-        #   计算输入图片的高和宽
-        #---------------------------------------------------#
-        image_shape = np.array(np.shape(image)[0:2])
-        #---------------------------------------------------------#
-        #   在这里将图像转换成RGB图像，防止灰度图在预测时报错。
-        #   代码仅仅支持RGB图像的预测，所有其它类型的图像都会转化成RGB
-        #---------------------------------------------------------#
-        image       = cvtColor(image)
-        #---------------------------------------------------------#
-        #   给图像增加灰条，实现不失真的resize
-        #   也可以直接resize进行识别
-        #---------------------------------------------------------#
-        image_data  = resize_image(image, (self.input_shape[1],self.input_shape[0]), self.letterbox_image)
-        #---------------------------------------------------------#
-        #   添加上batch_size维度
-        #---------------------------------------------------------#
-        image_data  = np.expand_dims(np.transpose(preprocess_input(np.array(image_data, dtype='float32')), (2, 0, 1)), 0)
-
-        with torch.no_grad():
-            images = torch.from_numpy(image_data)
-            if self.cuda:
-                images = images.cuda()
-            #---------------------------------------------------------#
-            #   将图像输入网络当中进行预测！
-            #---------------------------------------------------------#
-            outputs = self.net(images)
-            outputs = self.bbox_util.decode_box(outputs)
-            #---------------------------------------------------------#
-            #   将预测框进行堆叠，然后进行非极大抑制
-            #---------------------------------------------------------#
-            outputs = self.bbox_util.non_max_suppression(torch.cat(outputs, 1), self.num_classes, self.input_shape, 
-                        image_shape, self.letterbox_image, conf_thres = self.confidence, nms_thres = self.nms_iou)
-                                                    
-            if outputs[0] is None: 
-                return results
+        return self.detect_images([image_id], [image], results, clsid2catid)
 
-            top_label   = np.array(outputs[0][:, 6], dtype = 'int32')
-            top_conf    = outputs[0][:, 4] * outputs[0][:, 5]
-            top_boxes   = outputs[0][:, :4]
+    #---------------------------------------------------#
+    #   批量检测图片，一个batch只进行一次前向传播
+    #   使用与训练时一致的PIL预处理
+    #---------------------------------------------------#
+    def detect_images(self, image_ids, images, results, clsid2catid):
+        for image_id, outputs in zip(image_ids, self.detect_batch(images, evaluate = True)):
+            if outputs is None:
+                continue
+            top_label, top_conf, top_boxes = outputs
 
-        for i, c in enumerate(top_label):
-            result                      = {}
-            top, left, bottom, right    = top_boxes[i]
+            for i, c in enumerate(top_label):
+                result                      = {}
+                top, left, bottom, right    = top_boxes[i]
 
-            result["image_id"]      = int(image_id)
-            result["category_id"]   = clsid2catid[c]
-            result["bbox"]          = [float(left),float(top),float(right-left),float(bottom-top)]
-            result["score"]         = float(top_conf[i])
-            results.append(result)
+                result["image_id"]      = int(image_id)
+                result["category_id"]   = clsid2catid[c]
+                result["bbox"]          = [float(left),float(top),float(right-left),float(bottom-top)]
+                result["score"]         = float(top_conf[i])
+                results.append(result)
         return results
 
 if __name__ == "__main__":
@@ -98,10 +70,10 @@ if __name__ == "__main__":
 
         with open(os.path.join(temp_save_path, 'eval_results.json'),"w") as f:
             results = []
-            for image_id in tqdm(ids):
-                image_path  = os.path.join(dataset_img_path, cocoGt.loadImgs(image_id)[0]['file_name'])
-                image       = Image.open(image_path)
-                results     = yolo.detect_image(image_id, image, results, clsid2catid)
+            for start in tqdm(range(0, len(ids), batch_size)):
+                batch_ids   = ids[start:start + batch_size]
+                images      = [Image.open(os.path.join(dataset_img_path, cocoGt.loadImgs(image_id)[0]['file_name'])) for image_id in batch_ids]
+                results     = yolo.detect_images(batch_ids, images, results, clsid2catid)
             json.dump(results, f)
 
     if map_mode == 0 or map_mode == 2:
@@ -1,13 +1,12 @@
-import colorsys
+import hashlib
 import os
 import time
 
 import numpy as np
 import torch
-import torch.nn as nn
-from PIL import ImageDraw, ImageFont
+from PIL import Image
 
-from nets.yolo import YoloBody
+from nets.yolo import YoloBody, YoloInference
 from utils.utils import (
     cvtColor,
     get_anchors,
@@ -17,50 +16,51 @@ from utils.utils import (
     show_config,
 )
 from utils.utils_bbox import DecodeBox
-import cv2
-
-
-import math
-
-left_camera_matrix = np.array([   [509.7227,   -1.1239,  310.6237],
-                                            [       0,  509.2412,  253.9160],
-                                            [       0,         0,         1]
-                                        ])
-right_camera_matrix = np.array([  [509.6494,   -1.7097,  311.0560],
-                                            [       0,  508.6277,  256.8951],
-                                            [       0,         0,         1]
-                                        ])
-left_distortion = np.array([[0.2423, -0.2787, 0.0130, -0.0122, 0.1445]])
-right_distortion  = np.array([[0.2448, -0.2297, 0.0126, -0.0127, 0.0050]])
-R = np.array([ [1.0000,  -0.0009, 0.0095],
-                            [0.0009,  1.0000, 0.0016],
-                            [ -0.0095,  -0.0016,  1.0000]   
-                            ])
-T = np.array([[63.5133], [-0.0322], [-1.3117]])
-size = (640, 480)
-R1, R2, P1, P2, Q, validPixROI1, validPixROI2 = cv2.stereoRectify(
-    left_camera_matrix,
-    left_distortion,
-    right_camera_matrix,
-    right_distortion,
-    size,
-    R,
-    T,
-)
-left_map1, left_map2 = cv2.initUndistortRectifyMap(
-    left_camera_matrix, left_distortion, R1, P1, size, cv2.CV_16SC2
-)
-right_map1, right_map2 = cv2.initUndistortRectifyMap(
-    right_camera_matrix, right_distortion, R2, P2, size, cv2.CV_16SC2
-)
-WIN_NAME = "depth"
-cv2.namedWindow(WIN_NAME, cv2.WINDOW_AUTOSIZE)
+from utils.utils_preprocess import Preprocessor, image_hw
+from yolo_base import YOLOBase, get_calibration
+
+# ---------------------------------------------------#
+#   预测模型缓存的路径，与model_path放在同一个文件夹下
+#   由权重与先验框的sha1、输入大小、phi、类别数与内存格式共同决定，
+#   先验框在trace时固定在模型的解码部分中，
+#   权重、先验框或者这些设置变化后会重新生成
+#   int8为True时是quantize.py生成的INT8模型
+# ---------------------------------------------------#
+def get_jit_path(
+    model_path,
+    input_shape,
+    phi,
+    num_classes,
+    anchors,
+    anchors_mask,
+    channels_last,
+    int8=False,
+):
+    sha1 = hashlib.sha1()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    sha1.update(np.asarray(anchors, dtype=np.float64).tobytes())
+    sha1.update(str([[int(i) for i in mask] for mask in anchors_mask]).encode())
+    name = "%s_%s_%dx%d_%s_%d%s%s.torchscript" % (
+        os.path.splitext(os.path.basename(model_path))[0],
+        sha1.hexdigest()[:12],
+        input_shape[0],
+        input_shape[1],
+        phi,
+        num_classes,
+        "_cl" if channels_last else "",
+        "_int8" if int8 else "",
+    )
+    return os.path.join(os.path.dirname(model_path), name)
+
+
 """
 训练自己的数据集必看注释！
 """
 
 
-class YOLO(object):
+class YOLO(YOLOBase):
     _defaults = {
         # --------------------------------------------------------------------------#
         #   使用自己训练好的模型进行预测一定要修改model_path和classes_path！
@@ -95,24 +95,53 @@ class YOLO(object):
         # ---------------------------------------------------------------------#
         "nms_iou": 0.3,
         # ---------------------------------------------------------------------#
+        #   每张图片最多保留的预测框数量，None时不限制
+        #   计算mAP时始终不限制，保证与限制前的结果一致
+        # ---------------------------------------------------------------------#
+        "max_det": 300,
+        # ---------------------------------------------------------------------#
         #   该变量用于控制是否使用letterbox_image对输入图像进行不失真的resize，
         #   在多次测试后，发现关闭letterbox_image直接resize的效果更好
         # ---------------------------------------------------------------------#
         "letterbox_image": True,
+        # ---------------------------------------------------------------------#
+        #   preprocess          预处理的方式
+        #   'cv2'               直接在uint8数组上用cv2.resize，写入重复使用的缓冲区
+        #   'pil'               原先的PIL bicubic resize，与训练时的预处理完全一致
+        #   get_map_txt等计算mAP的地方始终使用'pil'
+        # ---------------------------------------------------------------------#
+        "preprocess": "cv2",
         # -------------------------------#
         #   是否使用Cuda
         #   没有GPU可以设置成False
         # -------------------------------#
         "cuda": True,
+        # ---------------------------------------------------------------------#
+        #   precision           网络前向传播的精度，可选'fp32'、'fp16'、'bf16'
+        #                       'fp16'与'bf16'使用autocast，需要torch>=1.10，
+        #                       解码与非极大抑制始终在fp32下进行
+        #   channels_last       是否使用channels_last的内存格式，
+        #                       与bf16配合在较新的CPU上可以明显提高速度
+        # ---------------------------------------------------------------------#
+        "precision": "fp32",
+        "channels_last": False,
+        # ---------------------------------------------------------------------#
+        #   jit                 是否使用TorchScript的预测模型
+        #                       第一次运行时把合并BN后的网络与解码一起trace，
+        #                       保存在model_path旁边，之后直接读取，
+        #                       不再构建python的模型，也省去python的调用开销
+        #                       jit为True时不能使用detect_heatmap
+        # ---------------------------------------------------------------------#
+        "jit": False,
+        # ---------------------------------------------------------------------#
+        #   int8                是否使用静态INT8量化的预测模型，只能在CPU上运行
+        #                       模型需要先用quantize.py在验证集上校准生成，
+        #                       与jit相同，保存在model_path旁边
+        # ---------------------------------------------------------------------#
+        "int8": False,
+        **YOLOBase._defaults,
     }
 
-    @classmethod
-    def get_defaults(cls, n):
-        if n in cls._defaults:
-            return cls._defaults[n]
-        else:
-            return "Unrecognized attribute name '" + n + "'"
-
     # ---------------------------------------------------#
     #   初始化YOLO
     # ---------------------------------------------------#
@@ -134,16 +163,9 @@ class YOLO(object):
             self.anchors_mask,
         )
 
-        # ---------------------------------------------------#
-        #   画框设置不同的颜色
-        # ---------------------------------------------------#
-        hsv_tuples = [(x / self.num_classes, 1.0, 1.0) for x in range(self.num_classes)]
-        self.colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
-        self.colors = list(
-            map(
-                lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)),
-                self.colors,
-            )
+        self.init_base()
+        self.preprocessor = Preprocessor(
+            self.input_shape, self.letterbox_image, self.cuda
         )
         self.generate()
 
@@ -153,125 +175,118 @@ class YOLO(object):
     #   生成模型
     # ---------------------------------------------------#
     def generate(self, onnx=False):
+        if (self.jit or self.int8) and not onnx:
+            self.generate_jit()
+            return
         # ---------------------------------------------------#
         #   建立yolo模型，载入yolo模型的权重
         # ---------------------------------------------------#
         self.net = YoloBody(self.anchors_mask, self.num_classes, self.phi)
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.net.load_state_dict(torch.load(self.model_path, map_location=device))
-        self.net = self.net.eval()
+        # ---------------------------------------------------#
+        #   预测时把BatchNorm合并进卷积，输出与合并前一致
+        # ---------------------------------------------------#
+        self.net = self.net.fuse().eval()
         print("{} model, and classes loaded.".format(self.model_path))
         if not onnx:
+            if self.channels_last:
+                self.net = self.net.to(memory_format=torch.channels_last)
+            # ---------------------------------------------------#
+            #   预测时只使用一张显卡，不再包一层DataParallel
+            # ---------------------------------------------------#
             if self.cuda:
-                self.net = nn.DataParallel(self.net)
                 self.net = self.net.cuda()
 
     # ---------------------------------------------------#
-    #   检测图片
+    #   生成或读取TorchScript的预测模型
+    #   模型的输出已经完成解码，与decode_box堆叠后的结果一致
+    #   INT8模型不能在这里生成，需要先运行quantize.py
     # ---------------------------------------------------#
-    def detect_image(self, image, crop=False, count=False):
-
-        frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        frame1 = frame[0:480, 0:640]
-        frame2 = frame[0:480, 640:1280]
-
-        imgL = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-        imgR = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-
-        img1_rectified = cv2.remap(imgL, left_map1, left_map2, cv2.INTER_LINEAR)
-        img2_rectified = cv2.remap(imgR, right_map1, right_map2, cv2.INTER_LINEAR)
-
-        num = cv2.getTrackbarPos("num", "depth")  # 6
-        blockSize = cv2.getTrackbarPos("blockSize", "depth")  # 10
-
-        if blockSize % 2 == 0:
-            blockSize += 1
-        if blockSize < 5:
-            blockSize = 5
-        img_channels = 3
-        stereo = cv2.StereoSGBM_create(
-            minDisparity=1,
-            numDisparities=16 * num,
-            blockSize=blockSize,
-            P1=8 * img_channels * blockSize * blockSize,
-            P2=32 * img_channels * blockSize * blockSize,
-            disp12MaxDiff=-1,
-            preFilterCap=1,
-            uniquenessRatio=10,
-            speckleWindowSize=100,
-            speckleRange=100,
-            mode=cv2.STEREO_SGBM_MODE_HH,
-        )
-
-        disparity = stereo.compute(img1_rectified, img2_rectified)
-
-        disp = cv2.normalize(
-            disparity,
-            disparity,
-            alpha=0,
-            beta=255,
-            norm_type=cv2.NORM_MINMAX,
-            dtype=cv2.CV_8U,
+    def generate_jit(self):
+        jit_path = get_jit_path(
+            self.model_path,
+            self.input_shape,
+            self.phi,
+            self.num_classes,
+            self.anchors,
+            self.anchors_mask,
+            self.channels_last,
+            self.int8,
         )
+        if self.int8 and (self.cuda or self.precision != "fp32"):
+            raise ValueError("int8为True时需要设置cuda = False、precision = 'fp32'。")
+        device = torch.device("cuda" if self.cuda else "cpu")
+        if os.path.exists(jit_path):
+            self.net = torch.jit.load(jit_path, map_location=device).eval()
+            print("{} model, and classes loaded.".format(jit_path))
+            return
+        if self.int8:
+            raise ValueError(
+                "{} does not exist, please run quantize.py first.".format(jit_path)
+            )
 
-        dis_color = disparity
-        dis_color = cv2.normalize(
-            dis_color,
-            None,
-            alpha=0,
-            beta=255,
-            norm_type=cv2.NORM_MINMAX,
-            dtype=cv2.CV_8U,
-        )
-        dis_color = cv2.applyColorMap(dis_color, 2)
-        cv2.imshow(WIN_NAME, disp)
+        net = YoloBody(self.anchors_mask, self.num_classes, self.phi)
+        net.load_state_dict(torch.load(self.model_path, map_location="cpu"))
+        net = net.fuse().eval()
+        if self.channels_last:
+            net = net.to(memory_format=torch.channels_last)
+        net = YoloInference(
+            net, self.anchors, self.anchors_mask, self.num_classes, self.input_shape
+        ).eval()
+        with torch.no_grad():
+            net = torch.jit.trace(net, torch.zeros(1, 3, *self.input_shape))
+        net.save(jit_path)
+        self.net = net.to(device)
+        print("{} model, and classes loaded.".format(self.model_path))
+        print("Save TorchScript model to {}".format(jit_path))
 
-        threeD = cv2.reprojectImageTo3D(disparity, Q, handleMissingValues=True)
+    # ---------------------------------------------------#
+    #   按照precision与channels_last进行前向传播
+    #   输出统一转回fp32，保证解码与非极大抑制的数值稳定
+    # ---------------------------------------------------#
+    def run_net(self, images):
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        if self.precision == "fp32":
+            outputs = self.net(images)
+        else:
+            dtypes = {"fp16": torch.float16, "bf16": torch.bfloat16}
+            if self.precision not in dtypes:
+                raise ValueError(
+                    "Unsupported precision - `{}`, Use fp32, fp16, bf16.".format(
+                        self.precision
+                    )
+                )
+            if not hasattr(torch, "autocast"):
+                raise ValueError("precision为fp16或bf16时需要torch>=1.10。")
+            with torch.autocast(
+                device_type="cuda" if self.cuda else "cpu",
+                dtype=dtypes[self.precision],
+            ):
+                outputs = self.net(images)
+        if isinstance(outputs, torch.Tensor):
+            outputs = [outputs]
+        return [output.float().contiguous() for output in outputs]
 
-        threeD = threeD * 16
-        # ---------------------------------------------------#
-        #   计算输入图片的高和宽
-        # ---------------------------------------------------#
-        image_shape = np.array(np.shape(image)[0:2])
-        # box = (0, 0, image_shape[0], image_shape[1]/2)
-        box = (0, 0, image_shape[1] / 2, image_shape[0])
-        image = image.crop(box)
-        image_shape = np.array(np.shape(image)[0:2])
-        # ---------------------------------------------------------#
-        #   在这里将图像转换成RGB图像，防止灰度图在预测时报错。
-        #   代码仅仅支持RGB图像的预测，所有其它类型的图像都会转化成RGB
-        # ---------------------------------------------------------#
-        image = cvtColor(image)
-        # ---------------------------------------------------------#
-        #   给图像增加灰条，实现不失真的resize
-        #   也可以直接resize进行识别
-        # ---------------------------------------------------------#
-        image_data = resize_image(
-            image, (self.input_shape[1], self.input_shape[0]), self.letterbox_image
-        )
-        # ---------------------------------------------------------#
-        #   添加上batch_size维度
-        # ---------------------------------------------------------#
-        image_data = np.expand_dims(
-            np.transpose(
-                preprocess_input(np.array(image_data, dtype="float32")), (2, 0, 1)
-            ),
-            0,
-        )
+    # ---------------------------------------------------#
+    #   解码网络的输出，jit与int8模型在网络中已经完成解码
+    # ---------------------------------------------------#
+    def decode(self, outputs):
+        if self.jit or self.int8:
+            return outputs
+        return self.bbox_util.decode_box(outputs)
 
-        with torch.no_grad():
-            images = torch.from_numpy(image_data)
-            if self.cuda:
-                images = images.cuda()
-            # ---------------------------------------------------------#
-            #   将图像输入网络当中进行预测！
-            # ---------------------------------------------------------#
-            outputs = self.net(images)
-            outputs = self.bbox_util.decode_box(outputs)
-            # ---------------------------------------------------------#
-            #   将预测框进行堆叠，然后进行非极大抑制
-            # ---------------------------------------------------------#
-            results = self.bbox_util.non_max_suppression(
+    # ---------------------------------------------------#
+    #   网络输出的后处理，返回non_max_suppression的结果
+    #   原始输出先按置信度筛选，只解码留下来的先验框；
+    #   jit与int8模型的输出已经解码，直接进行非极大抑制
+    #   evaluate为True时用于计算mAP，不限制预测框的数量
+    # ---------------------------------------------------#
+    def postprocess(self, outputs, image_shape, evaluate=False):
+        max_det = None if evaluate else self.max_det
+        if self.jit or self.int8:
+            return self.bbox_util.non_max_suppression(
                 torch.cat(outputs, 1),
                 self.num_classes,
                 self.input_shape,
@@ -279,119 +294,161 @@ class YOLO(object):
                 self.letterbox_image,
                 conf_thres=self.confidence,
                 nms_thres=self.nms_iou,
+                max_det=max_det,
             )
-
-            if results[0] is None:
-                return image
-
-            top_label = np.array(results[0][:, 6], dtype="int32")
-            top_conf = results[0][:, 4] * results[0][:, 5]
-            top_boxes = results[0][:, :4]
-        # ---------------------------------------------------------#
-        #   设置字体与边框厚度
-        # ---------------------------------------------------------#
-        font = ImageFont.truetype(
-            font="model_data/simhei.ttf",
-            size=np.floor(3e-2 * image.size[1] + 0.5).astype("int32"),
-        )
-        thickness = int(
-            max((image.size[0] + image.size[1]) // np.mean(self.input_shape), 1)
+        return self.bbox_util.decode_nms(
+            outputs,
+            self.input_shape,
+            image_shape,
+            self.letterbox_image,
+            conf_thres=self.confidence,
+            nms_thres=self.nms_iou,
+            max_det=max_det,
         )
+
+    # ---------------------------------------------------#
+    #   批量检测图片
+    #   images为PIL图像或HWC的uint8数组的列表，尺寸可以各不相同
+    #   数组默认为RGB，bgr为True时为cv2读取的BGR
+    #   所有图像resize后堆叠为一个batch，只进行一次前向传播、解码与非极大抑制
+    #   返回每张图片的(top_label, top_conf, top_boxes)，框已映射回各自的原图尺寸，
+    #   没有检测到目标的图片对应None
+    #   evaluate为True时用于计算mAP，始终使用与训练时一致的PIL预处理，
+    #   并且不限制预测框的数量
+    # ---------------------------------------------------#
+    def detect_batch(self, images, bgr=False, evaluate=False):
+        if len(images) == 0:
+            return []
         # ---------------------------------------------------------#
-        #   计数
-        # ---------------------------------------------------------#
-        if count:
-            print("top_label:", top_label)
-            classes_nums = np.zeros([self.num_classes])
-            for i in range(self.num_classes):
-                num = np.sum(top_label == i)
-                if num > 0:
-                    print(self.class_names[i], " : ", num)
-                classes_nums[i] = num
-            print("classes_nums:", classes_nums)
-        # ---------------------------------------------------------#
-        #   是否进行目标的裁剪
-        # ---------------------------------------------------------#
-        if crop:
-            for i, c in list(enumerate(top_boxes)):
-                top, left, bottom, right = top_boxes[i]
-                top = max(0, np.floor(top).astype("int32"))
-                left = max(0, np.floor(left).astype("int32"))
-                bottom = min(image.size[1], np.floor(bottom).astype("int32"))
-                right = min(image.size[0], np.floor(right).astype("int32"))
-
-                dir_save_path = "img_crop"
-                if not os.path.exists(dir_save_path):
-                    os.makedirs(dir_save_path)
-                crop_image = image.crop([left, top, right, bottom])
-                crop_image.save(
-                    os.path.join(dir_save_path, "crop_" + str(i) + ".png"),
-                    quality=95,
-                    subsampling=0,
-                )
-                print("save crop_" + str(i) + ".png to " + dir_save_path)
-        # ---------------------------------------------------------#
-        #   图像绘制
+        #   计算输入图片的高和宽
         # ---------------------------------------------------------#
-        for i, c in list(enumerate(top_label)):
-            predicted_class = self.class_names[int(c)]
-            box = top_boxes[i]
-            score = top_conf[i]
-
-            top, left, bottom, right = box
-
-            top = max(0, np.floor(top).astype("int32"))
-            left = max(0, np.floor(left).astype("int32"))
-            bottom = min(image.size[1], np.floor(bottom).astype("int32"))
-            right = min(image.size[0], np.floor(right).astype("int32"))
+        image_shapes = [image_hw(image) for image in images]
+        if self.preprocess == "cv2" and not evaluate:
+            images = self.preprocessor(images, bgr=bgr)
+        else:
+            images = torch.from_numpy(self.preprocess_pil(images, bgr=bgr))
+            if self.cuda:
+                images = images.cuda()
 
+        with torch.no_grad():
+            # ---------------------------------------------------------#
+            #   将图像输入网络当中进行预测！
             # ---------------------------------------------------------#
-            middle_x = int(np.floor((left + right) / 2))
-            middle_y = int(np.floor((top + bottom) / 2))
-
-            print("\n像素坐标 x = %d, y = %d" % (middle_x, middle_y))
-            # print("世界坐标是：", threeD[y][x][0], threeD[y][x][1], threeD[y][x][2], "mm")
-            print(
-                "世界坐标xyz 是：",
-                threeD[middle_y][middle_x][0] / 1000.0,
-                threeD[middle_y][middle_x][1] / 1000.0,
-                threeD[middle_y][middle_x][2] / 1000.0,
-                "m",
+            outputs = self.run_net(images)
+            # ---------------------------------------------------------#
+            #   筛选、解码预测框，然后进行非极大抑制
+            # ---------------------------------------------------------#
+            results = self.postprocess(
+                outputs, np.stack(image_shapes, 0), evaluate=evaluate
             )
 
-            distance = math.sqrt(
-                threeD[middle_y][middle_x][0] ** 2
-                + threeD[middle_y][middle_x][1] ** 2
-                + threeD[middle_y][middle_x][2] ** 2
-            )
-            distance = distance / 1000.0  # mm -> m
-            print("距离是：", distance, "m")
+        detections = []
+        for result in results:
+            if result is None:
+                detections.append(None)
+                continue
+            top_label = np.array(result[:, 6], dtype="int32")
+            top_conf = result[:, 4] * result[:, 5]
+            top_boxes = result[:, :4]
+            detections.append((top_label, top_conf, top_boxes))
+        return detections
 
+    # ---------------------------------------------------#
+    #   原先基于PIL的预处理，返回NCHW的float32数组
+    # ---------------------------------------------------#
+    def preprocess_pil(self, images, bgr=False):
+        image_data = []
+        for image in images:
+            if not isinstance(image, Image.Image):
+                image = Image.fromarray(
+                    np.ascontiguousarray(image[..., ::-1]) if bgr else image
+                )
             # ---------------------------------------------------------#
-
-            label = "{} {:.2f} dis={:.2f}m".format(predicted_class, score, distance)
-            draw = ImageDraw.Draw(image)
-            label_size = draw.textsize(label, font)
-            label = label.encode("utf-8")
-            print(label, top, left, bottom, right)
-
-            if top - label_size[1] >= 0:
-                text_origin = np.array([left, top - label_size[1]])
-            else:
-                text_origin = np.array([left, top + 1])
-
-            for i in range(thickness):
-                draw.rectangle(
-                    [left + i, top + i, right - i, bottom - i], outline=self.colors[c]
+            #   在这里将图像转换成RGB图像，防止灰度图在预测时报错。
+            #   给图像增加灰条，实现不失真的resize
+            # ---------------------------------------------------------#
+            image = resize_image(
+                cvtColor(image),
+                (self.input_shape[1], self.input_shape[0]),
+                self.letterbox_image,
+            )
+            image_data.append(
+                np.transpose(
+                    preprocess_input(np.array(image, dtype="float32")), (2, 0, 1)
                 )
-            draw.rectangle(
-                [tuple(text_origin), tuple(text_origin + label_size)],
-                fill=self.colors[c],
             )
-            draw.text(text_origin, str(label, "UTF-8"), fill=(0, 0, 0), font=font)
-            del draw
+        return np.stack(image_data, 0)
 
-        return image
+    # ---------------------------------------------------#
+    #   比较precision与channels_last设置下的预测结果与fp32的差异
+    #   参考结果使用fp32与默认的内存格式，
+    #   按类别与IoU把两次的框一一对应，
+    #   返回fp32框数、当前模式框数、匹配上的框数、匹配框坐标与得分的最大差值，
+    #   以及结果是否在容差之内
+    #   box_tol     匹配框坐标的最大差值，单位为像素
+    #   conf_tol    匹配框得分的最大差值
+    #   min_match   匹配上的框数至少占两次框数中较多者的比例
+    # ---------------------------------------------------#
+    def compare_precision(
+        self,
+        image,
+        precision=None,
+        iou_thres=0.5,
+        box_tol=2.0,
+        conf_tol=0.02,
+        min_match=0.95,
+    ):
+        precision = self.precision if precision is None else precision
+        old_precision, channels_last = self.precision, self.channels_last
+        # ---------------------------------------------------------#
+        #   TorchScript的模型在trace时已经固定了内存格式，只比较精度
+        # ---------------------------------------------------------#
+        convert = channels_last and not (self.jit or self.int8)
+        try:
+            self.precision, self.channels_last = "fp32", False
+            if convert:
+                self.net = self.net.to(memory_format=torch.contiguous_format)
+            reference = self.inference(image)
+            self.precision, self.channels_last = precision, channels_last
+            if convert:
+                self.net = self.net.to(memory_format=torch.channels_last)
+            results = self.inference(image)
+        finally:
+            self.precision, self.channels_last = old_precision, channels_last
+            if convert:
+                self.net = self.net.to(memory_format=torch.channels_last)
+
+        num_ref = 0 if reference is None else len(reference[0])
+        num_res = 0 if results is None else len(results[0])
+        if num_ref == 0 or num_res == 0:
+            return num_ref, num_res, 0, 0.0, 0.0, num_ref == num_res
+
+        ref_label, ref_conf, ref_boxes = reference
+        res_label, res_conf, res_boxes = results
+        # ---------------------------------------------------------#
+        #   计算两组框之间的IoU，不同类别的IoU记为0
+        # ---------------------------------------------------------#
+        tl = np.maximum(ref_boxes[:, None, :2], res_boxes[None, :, :2])
+        br = np.minimum(ref_boxes[:, None, 2:], res_boxes[None, :, 2:])
+        inter = np.prod(np.clip(br - tl, 0, None), -1)
+        area_ref = np.prod(ref_boxes[:, 2:] - ref_boxes[:, :2], -1)
+        area_res = np.prod(res_boxes[:, 2:] - res_boxes[:, :2], -1)
+        iou = inter / np.maximum(area_ref[:, None] + area_res[None] - inter, 1e-6)
+        iou[ref_label[:, None] != res_label[None]] = 0
+
+        best = np.argmax(iou, 1)
+        matched = iou[np.arange(len(ref_boxes)), best] > iou_thres
+        if not matched.any():
+            return num_ref, num_res, 0, 0.0, 0.0, False
+        box_diff = float(np.abs(ref_boxes[matched] - res_boxes[best[matched]]).max())
+        conf_diff = float(np.abs(ref_conf[matched] - res_conf[best[matched]]).max())
+        num_matched = int(matched.sum())
+        passed = (
+            num_matched >= min_match * max(num_ref, num_res)
+            and box_diff <= box_tol
+            and conf_diff <= conf_tol
+        )
+        return num_ref, num_res, num_matched, box_diff, conf_diff, passed
 
     def get_FPS(self, image, test_interval):
         image_shape = np.array(np.shape(image)[0:2])
@@ -424,20 +481,11 @@ class YOLO(object):
             # ---------------------------------------------------------#
             #   将图像输入网络当中进行预测！
             # ---------------------------------------------------------#
-            outputs = self.net(images)
-            outputs = self.bbox_util.decode_box(outputs)
+            outputs = self.run_net(images)
             # ---------------------------------------------------------#
-            #   将预测框进行堆叠，然后进行非极大抑制
+            #   筛选、解码预测框，然后进行非极大抑制
             # ---------------------------------------------------------#
-            results = self.bbox_util.non_max_suppression(
-                torch.cat(outputs, 1),
-                self.num_classes,
-                self.input_shape,
-                image_shape,
-                self.letterbox_image,
-                conf_thres=self.confidence,
-                nms_thres=self.nms_iou,
-            )
+            results = self.postprocess(outputs, image_shape)
 
         t1 = time.time()
         for _ in range(test_interval):
@@ -445,20 +493,11 @@ class YOLO(object):
                 # ---------------------------------------------------------#
                 #   将图像输入网络当中进行预测！
                 # ---------------------------------------------------------#
-                outputs = self.net(images)
-                outputs = self.bbox_util.decode_box(outputs)
+                outputs = self.run_net(images)
                 # ---------------------------------------------------------#
-                #   将预测框进行堆叠，然后进行非极大抑制
+                #   筛选、解码预测框，然后进行非极大抑制
                 # ---------------------------------------------------------#
-                results = self.bbox_util.non_max_suppression(
-                    torch.cat(outputs, 1),
-                    self.num_classes,
-                    self.input_shape,
-                    image_shape,
-                    self.letterbox_image,
-                    conf_thres=self.confidence,
-                    nms_thres=self.nms_iou,
-                )
+                results = self.postprocess(outputs, image_shape)
 
         t2 = time.time()
         tact_time = (t2 - t1) / test_interval
@@ -468,6 +507,11 @@ class YOLO(object):
         import cv2
         import matplotlib.pyplot as plt
 
+        if self.jit or self.int8:
+            raise ValueError(
+                "detect_heatmap需要网络的原始输出，请将jit与int8设置为False。"
+            )
+
         def sigmoid(x):
             y = 1.0 / (1.0 + np.exp(-x))
             return y
@@ -501,7 +545,7 @@ class YOLO(object):
             # ---------------------------------------------------------#
             #   将图像输入网络当中进行预测！
             # ---------------------------------------------------------#
-            outputs = self.net(images)
+            outputs = self.run_net(images)
 
         plt.imshow(image, alpha=1)
         plt.axis("off")
@@ -526,7 +570,14 @@ class YOLO(object):
         print("Save to the " + heatmap_save_path)
         plt.show()
 
-    def convert_to_onnx(self, simplify, model_path):
+    # ---------------------------------------------------#
+    #   导出onnx
+    #   dynamic_batch   batch_size维度是否可变
+    #   decode          是否把解码一起导出，导出后的输出为
+    #                   batch_size, num_anchors, 4 + 1 + num_classes，
+    #                   可以直接用于yolo_onnx.OnnxYOLO
+    # ---------------------------------------------------#
+    def convert_to_onnx(self, simplify, model_path, dynamic_batch=False, decode=False):
         import onnx
 
         self.generate(onnx=True)
@@ -535,12 +586,30 @@ class YOLO(object):
             "cpu"
         )  # image size(1, 3, 512, 512) BCHW
         input_layer_names = ["images"]
-        output_layer_names = ["output"]
+        if decode:
+            net = YoloInference(
+                self.net,
+                self.anchors,
+                self.anchors_mask,
+                self.num_classes,
+                self.input_shape,
+            ).eval()
+            output_layer_names = ["output"]
+        else:
+            net = self.net
+            output_layer_names = (
+                ["output0", "output1", "output2"] if dynamic_batch else ["output"]
+            )
+        dynamic_axes = None
+        if dynamic_batch:
+            dynamic_axes = {
+                name: {0: "batch"} for name in input_layer_names + output_layer_names
+            }
 
         # Export the model
         print(f"Starting export with onnx {onnx.__version__}.")
         torch.onnx.export(
-            self.net,
+            net,
             im,
             f=model_path,
             verbose=False,
@@ -549,7 +618,7 @@ class YOLO(object):
             do_constant_folding=True,
             input_names=input_layer_names,
             output_names=output_layer_names,
-            dynamic_axes=None,
+            dynamic_axes=dynamic_axes,
         )
 
         # Checks
@@ -562,7 +631,7 @@ class YOLO(object):
 
             print(f"Simplifying with onnx-simplifier {onnxsim.__version__}.")
             model_onnx, check = onnxsim.simplify(
-                model_onnx, dynamic_input_shape=False, input_shapes=None
+                model_onnx, dynamic_input_shape=dynamic_batch, input_shapes=None
             )
             assert check, "assert check failed"
             onnx.save(model_onnx, model_path)
@@ -575,57 +644,10 @@ class YOLO(object):
             "w",
             encoding="utf-8",
         )
-        image_shape = np.array(np.shape(image)[0:2])
-        # ---------------------------------------------------------#
-        #   在这里将图像转换成RGB图像，防止灰度图在预测时报错。
-        #   代码仅仅支持RGB图像的预测，所有其它类型的图像都会转化成RGB
-        # ---------------------------------------------------------#
-        image = cvtColor(image)
-        # ---------------------------------------------------------#
-        #   给图像增加灰条，实现不失真的resize
-        #   也可以直接resize进行识别
-        # ---------------------------------------------------------#
-        image_data = resize_image(
-            image, (self.input_shape[1], self.input_shape[0]), self.letterbox_image
-        )
-        # ---------------------------------------------------------#
-        #   添加上batch_size维度
-        # ---------------------------------------------------------#
-        image_data = np.expand_dims(
-            np.transpose(
-                preprocess_input(np.array(image_data, dtype="float32")), (2, 0, 1)
-            ),
-            0,
-        )
-
-        with torch.no_grad():
-            images = torch.from_numpy(image_data)
-            if self.cuda:
-                images = images.cuda()
-            # ---------------------------------------------------------#
-            #   将图像输入网络当中进行预测！
-            # ---------------------------------------------------------#
-            outputs = self.net(images)
-            outputs = self.bbox_util.decode_box(outputs)
-            # ---------------------------------------------------------#
-            #   将预测框进行堆叠，然后进行非极大抑制
-            # ---------------------------------------------------------#
-            results = self.bbox_util.non_max_suppression(
-                torch.cat(outputs, 1),
-                self.num_classes,
-                self.input_shape,
-                image_shape,
-                self.letterbox_image,
-                conf_thres=self.confidence,
-                nms_thres=self.nms_iou,
-            )
-
-            if results[0] is None:
-                return
-
-            top_label = np.array(results[0][:, 6], dtype="int32")
-            top_conf = results[0][:, 4] * results[0][:, 5]
-            top_boxes = results[0][:, :4]
+        results = self.detect_batch([image], evaluate=True)[0]
+        if results is None:
+            return
+        top_label, top_conf, top_boxes = results
 
         for i, c in list(enumerate(top_label)):
             predicted_class = self.class_names[int(c)]
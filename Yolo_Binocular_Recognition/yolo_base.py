@@ -0,0 +1,445 @@
+import colorsys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.utils import cvtColor
+from utils.utils_preprocess import image_hw
+from utils.utils_render import LabelRenderer
+from utils.utils_results import Detections
+from utils.utils_stereo import (
+    StereoDepthEngine,
+    TemporalDisparity,
+    create_calibration,
+    load_calibration,
+    save_calibration,
+)
+
+left_camera_matrix = np.array([   [509.7227,   -1.1239,  310.6237],
+                                            [       0,  509.2412,  253.9160],
+                                            [       0,         0,         1]
+                                        ])
+right_camera_matrix = np.array([  [509.6494,   -1.7097,  311.0560],
+                                            [       0,  508.6277,  256.8951],
+                                            [       0,         0,         1]
+                                        ])
+left_distortion = np.array([[0.2423, -0.2787, 0.0130, -0.0122, 0.1445]])
+right_distortion  = np.array([[0.2448, -0.2297, 0.0126, -0.0127, 0.0050]])
+R = np.array([ [1.0000,  -0.0009, 0.0095],
+                            [0.0009,  1.0000, 0.0016],
+                            [ -0.0095,  -0.0016,  1.0000]   
+                            ])
+T = np.array([[63.5133], [-0.0322], [-1.3117]])
+size = (640, 480)
+
+
+# ---------------------------------------------------#
+#   读取双目标定文件，不存在时用上面的标定结果生成
+# ---------------------------------------------------#
+def get_calibration(calib_path):
+    if not os.path.exists(calib_path):
+        save_calibration(
+            calib_path,
+            create_calibration(
+                left_camera_matrix,
+                left_distortion,
+                right_camera_matrix,
+                right_distortion,
+                R,
+                T,
+                size,
+            ),
+        )
+    return load_calibration(calib_path)
+
+
+# ---------------------------------------------------#
+#   YOLO与OnnxYOLO共用的部分：双目深度、检测流程与绘制
+#   不依赖torch，子类只需要实现detect_batch
+# ---------------------------------------------------#
+class YOLOBase(object):
+    _defaults = {
+        # ---------------------------------------------------------------------#
+        #   stereo_calib_path   双目标定文件，保存内参、R、T、Q与校正映射表
+        #                       文件不存在时用本文件中的标定结果生成一份
+        #                       更换相机时指向对应的标定文件即可
+        # ---------------------------------------------------------------------#
+        "stereo_calib_path": "model_data/stereo_calib.npz",
+        # ---------------------------------------------------------------------#
+        #   stereo_num          SGBM的numDisparities / 16
+        #   stereo_block_size   SGBM的blockSize，会被修正为不小于5的奇数
+        # ---------------------------------------------------------------------#
+        "stereo_num": 6,
+        "stereo_block_size": 10,
+        # ---------------------------------------------------------------------#
+        #   stereo_scale        计算视差前校正图像的缩放比例，可选1、0.5、0.25
+        #                       缩小后SGBM的耗时大约按面积与搜索范围同时下降，
+        #                       深度仍按原图的坐标读取，远处目标的精度会降低
+        #   stereo_mode         SGBM的模式，可选'HH'、'HH4'、'SGBM'、'3WAY'
+        #                       'HH'最慢也最精确，'SGBM'与'3WAY'只使用5个方向
+        # ---------------------------------------------------------------------#
+        "stereo_scale": 1,
+        "stereo_mode": "HH",
+        # ---------------------------------------------------------------------#
+        #   depth_mode          深度的计算方式
+        #   'full'              先计算整幅视差图与点云，再读取框中心的坐标
+        #   'roi'               先进行检测，只在每个框附近计算视差并重建
+        #   'temporal'          与'full'相同，但只在与上一帧相比变化的区域
+        #                       重新计算视差，适合相机固定、场景大部分静止的视频
+        # ---------------------------------------------------------------------#
+        "depth_mode": "full",
+        # ---------------------------------------------------------------------#
+        #   depth_stat          框内深度的估计方式
+        #   'center'            只读取框中心一个像素，中心为空洞时结果无效，
+        #                       与原先的结果一致
+        #   'median'            框内有效视差的中值，中心为空洞或离群点时更稳定
+        #   'trimmed'           框内有效视差去掉两端10%后的均值
+        # ---------------------------------------------------------------------#
+        "depth_stat": "center",
+        # ---------------------------------------------------------------------#
+        #   stereo_async        是否在后台线程中计算视差，同时进行网络预测
+        #                       单帧耗时约为二者中较大的一个，而不是二者之和
+        # ---------------------------------------------------------------------#
+        "stereo_async": False,
+        # ---------------------------------------------------------------------#
+        #   font_path           标签使用的字体
+        #   render_cv2          视频检测时是否直接用cv2在BGR图像上绘制，
+        #                       省去与PIL之间的转换，标签超出底色的笔画会被裁掉
+        # ---------------------------------------------------------------------#
+        "font_path": "model_data/simhei.ttf",
+        "render_cv2": False,
+    }
+
+    @classmethod
+    def get_defaults(cls, n):
+        if n in cls._defaults:
+            return cls._defaults[n]
+        else:
+            return "Unrecognized attribute name '" + n + "'"
+
+    # ---------------------------------------------------#
+    #   画框的颜色与双目深度相关的状态
+    # ---------------------------------------------------#
+    def init_base(self):
+        # ---------------------------------------------------#
+        #   画框设置不同的颜色
+        # ---------------------------------------------------#
+        hsv_tuples = [(x / self.num_classes, 1.0, 1.0) for x in range(self.num_classes)]
+        self.colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
+        self.colors = list(
+            map(
+                lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)),
+                self.colors,
+            )
+        )
+        # ---------------------------------------------------#
+        #   双目深度引擎在第一次使用时才创建
+        # ---------------------------------------------------#
+        self._stereo = None
+        self._stereo_executor = None
+        self._temporal = None
+        # ---------------------------------------------------#
+        #   视差图的可选输出，例如utils_stereo.DisparityWindow
+        #   为None时不进行任何界面操作
+        # ---------------------------------------------------#
+        self.disparity_sink = None
+        # ---------------------------------------------------#
+        #   字体与标签的缓存
+        # ---------------------------------------------------#
+        self.label_renderer = LabelRenderer(self.font_path, self.colors)
+
+    # ---------------------------------------------------#
+    #   双目深度引擎，匹配器只在参数变化时重建
+    #   只做训练或者计算mAP时不会读取标定文件
+    # ---------------------------------------------------#
+    @property
+    def stereo(self):
+        if self._stereo is None:
+            self._stereo = StereoDepthEngine.from_calibration(
+                get_calibration(self.stereo_calib_path),
+                num=self.stereo_num,
+                block_size=self.stereo_block_size,
+                mode=self.stereo_mode,
+                scale=self.stereo_scale,
+            )
+        return self._stereo
+
+    # ---------------------------------------------------#
+    #   depth_mode为'temporal'时缓存上一帧的视差
+    # ---------------------------------------------------#
+    @property
+    def temporal(self):
+        if self._temporal is None:
+            self._temporal = TemporalDisparity(self.stereo)
+        return self._temporal
+
+    # ---------------------------------------------------#
+    #   计算视差用的后台线程，只有stereo_async时才创建
+    # ---------------------------------------------------#
+    @property
+    def stereo_executor(self):
+        if self._stereo_executor is None:
+            self._stereo_executor = ThreadPoolExecutor(max_workers=1)
+        return self._stereo_executor
+
+    # ---------------------------------------------------#
+    #   检测图片，返回画好框的左目图像
+    #   与原先一样打印每个框的坐标与距离，crop与count时截取与计数
+    # ---------------------------------------------------#
+    def detect_image(self, image, crop=False, count=False):
+        left = self.crop_left(image)
+        detections = self.predict(image, left=left)
+        self.print_detections(detections)
+        if count:
+            self.count_detections(detections)
+        if crop:
+            self.crop_detections(left, detections)
+        return self.render(left, detections)
+
+    # ---------------------------------------------------#
+    #   检测与深度计算的核心，返回utils_results.Detections
+    #   不打印、不加载字体、不绘制，
+    #   只需要坐标时直接调用，画框、截取与计数都是可选的后续处理
+    #   depth   是否计算每个框的三维坐标，False时不进行双目计算
+    #   left    已经取出的左目图像，为None时从image中取出
+    # ---------------------------------------------------#
+    def predict(self, image, depth=True, left=None):
+        frame = None
+        if depth:
+            frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        if left is None:
+            left = self.crop_left(image)
+        return self.predict_left(left, frame)
+
+    # ---------------------------------------------------#
+    #   frame为左右拼接的BGR numpy图像，例如摄像头的帧
+    #   或utils_shm.SharedFrame.array，预处理直接读取frame，不做复制
+    # ---------------------------------------------------#
+    def predict_frame(self, frame, depth=True):
+        left = frame[:, : frame.shape[1] // 2]
+        return self.predict_left(left, frame if depth else None, bgr=True)
+
+    # ---------------------------------------------------#
+    #   predict与predict_frame共用的检测与深度计算
+    #   left    用于检测的左目图像，PIL图像或bgr为True时的BGR数组
+    #   frame   左右拼接的BGR图像，为None时不进行双目计算
+    # ---------------------------------------------------#
+    def predict_left(self, left, frame=None, bgr=False):
+        if frame is not None:
+            # ---------------------------------------------------------#
+            #   视差计算与网络预测互不依赖，
+            #   stereo_async时把视差放到后台线程，计算深度前再等待
+            # ---------------------------------------------------------#
+            if self.stereo_async:
+                stereo_future = self.stereo_executor.submit(self.compute_stereo, frame)
+            else:
+                img1_rectified, img2_rectified, disparity = self.compute_stereo(frame)
+
+        image_h, image_w = image_hw(left)
+        detections = Detections.from_results(
+            self.inference(left, bgr=bgr),
+            self.class_names,
+            (int(image_w), int(image_h)),
+        )
+        if frame is None:
+            return detections
+
+        if self.stereo_async:
+            img1_rectified, img2_rectified, disparity = stereo_future.result()
+        if disparity is not None and self.disparity_sink is not None:
+            self.disparity_sink(disparity)
+        return self.measure_depth(
+            detections, img1_rectified, img2_rectified, disparity
+        )
+
+    # ---------------------------------------------------#
+    #   双目校正与视差计算
+    #   frame为左右拼接的BGR图像，depth_mode为'roi'时只做校正
+    # ---------------------------------------------------#
+    def compute_stereo(self, frame):
+        img1_rectified, img2_rectified = self.stereo.rectify(frame)
+        disparity = None
+        if self.depth_mode != "roi":
+            disparity = self.compute_disparity(img1_rectified, img2_rectified)
+        return img1_rectified, img2_rectified, disparity
+
+    def compute_disparity(self, img1_rectified, img2_rectified):
+        if self.depth_mode == "temporal":
+            return self.temporal(img1_rectified, img2_rectified)
+        return self.stereo.compute(img1_rectified, img2_rectified)
+
+    # ---------------------------------------------------#
+    #   取出左目图像用于检测
+    # ---------------------------------------------------#
+    def crop_left(self, image):
+        # ---------------------------------------------------#
+        #   计算输入图片的高和宽
+        # ---------------------------------------------------#
+        image_shape = np.array(np.shape(image)[0:2])
+        # box = (0, 0, image_shape[0], image_shape[1]/2)
+        box = (0, 0, image_shape[1] / 2, image_shape[0])
+        image = image.crop(box)
+        # ---------------------------------------------------------#
+        #   在这里将图像转换成RGB图像，防止灰度图在预测时报错。
+        #   代码仅仅支持RGB图像的预测，所有其它类型的图像都会转化成RGB
+        # ---------------------------------------------------------#
+        return cvtColor(image)
+
+    # ---------------------------------------------------#
+    #   网络预测，返回top_label, top_conf, top_boxes
+    #   没有检测到目标时返回None
+    # ---------------------------------------------------#
+    def inference(self, image, bgr=False):
+        return self.detect_batch([image], bgr=bgr)[0]
+
+    # ---------------------------------------------------#
+    #   批量检测图片，由子类实现
+    # ---------------------------------------------------#
+    def detect_batch(self, images, bgr=False):
+        raise NotImplementedError
+
+    # ---------------------------------------------------#
+    #   计算每个框的三维坐标，写入detections.xyz与valid_ratio
+    #   stereo为None时使用self.stereo，
+    #   多线程计算时传入各线程自己的StereoDepthEngine副本
+    # ---------------------------------------------------#
+    def measure_depth(
+        self, detections, img1_rectified, img2_rectified, disparity, stereo=None
+    ):
+        if len(detections) == 0:
+            return detections
+        stereo = self.stereo if stereo is None else stereo
+        boxes = detections.pixel_boxes
+        centers = detections.centers
+
+        if self.depth_mode == "roi":
+            # ---------------------------------------------------------#
+            #   只在每个框附近计算视差
+            # ---------------------------------------------------------#
+            xyz = np.empty((len(boxes), 3), dtype=np.float32)
+            valid_ratio = np.empty(len(boxes), dtype=np.float32)
+            for i, box in enumerate(boxes):
+                box_disparity, offset = stereo.compute_roi(
+                    img1_rectified, img2_rectified, tuple(box)
+                )
+                xyz[i : i + 1], ratio = self.box_depth(
+                    stereo,
+                    box_disparity,
+                    boxes[i : i + 1],
+                    centers[i : i + 1],
+                    offset,
+                    missing=stereo.min_disparity * 16 - 1,
+                )
+                valid_ratio[i] = np.nan if ratio is None else ratio[0]
+            if self.depth_stat == "center":
+                valid_ratio = None
+        else:
+            xyz, valid_ratio = self.box_depth(
+                stereo, disparity, boxes, centers, (0, 0)
+            )
+
+        # mm -> m
+        detections.xyz = xyz / 1000.0
+        detections.valid_ratio = valid_ratio
+        return detections
+
+    # ---------------------------------------------------#
+    #   depth_stat为'center'时只对框中心一个像素用Q求三维坐标，
+    #   全图时缺失值取整幅视差的最小值，与reprojectImageTo3D一致；
+    #   否则用框内有效视差的统计值计算深度，不依赖中心像素
+    # ---------------------------------------------------#
+    def box_depth(self, stereo, disparity, boxes, centers, offset, missing=None):
+        if self.depth_stat == "center":
+            return stereo.lookup_xyz(disparity, centers, offset, missing=missing), None
+        return stereo.box_xyz(disparity, boxes, offset, method=self.depth_stat)
+
+    # ---------------------------------------------------#
+    #   打印每个框的像素坐标、三维坐标与距离
+    # ---------------------------------------------------#
+    def print_detections(self, detections):
+        boxes = detections.pixel_boxes
+        centers = detections.centers
+        distances = detections.distances
+        for i in range(len(detections)):
+            print("\n像素坐标 x = %d, y = %d" % tuple(centers[i]))
+            if detections.valid_ratio is not None:
+                print("有效视差比例：%.2f" % detections.valid_ratio[i])
+            if detections.xyz is not None:
+                print("世界坐标xyz 是：", *detections.xyz[i], "m")
+                print("距离是：", distances[i], "m")
+            top, left, bottom, right = boxes[i]
+            print(self.get_label(detections, i).encode("utf-8"), top, left, bottom, right)
+
+    # ---------------------------------------------------#
+    #   计数
+    # ---------------------------------------------------#
+    def count_detections(self, detections):
+        print("top_label:", detections.labels)
+        classes_nums = detections.counts()
+        for i in range(self.num_classes):
+            if classes_nums[i] > 0:
+                print(self.class_names[i], " : ", classes_nums[i])
+        print("classes_nums:", classes_nums)
+        return classes_nums
+
+    # ---------------------------------------------------#
+    #   截取每个目标并保存
+    # ---------------------------------------------------#
+    def crop_detections(self, image, detections, dir_save_path="img_crop"):
+        if not os.path.exists(dir_save_path):
+            os.makedirs(dir_save_path)
+        for i, (top, left, bottom, right) in enumerate(detections.pixel_boxes):
+            crop_image = image.crop([left, top, right, bottom])
+            crop_image.save(
+                os.path.join(dir_save_path, "crop_" + str(i) + ".png"),
+                quality=95,
+                subsampling=0,
+            )
+            print("save crop_" + str(i) + ".png to " + dir_save_path)
+
+    # ---------------------------------------------------#
+    #   框上显示的文字，计算了深度时带上距离
+    # ---------------------------------------------------#
+    def get_label(self, detections, i):
+        predicted_class = self.class_names[int(detections.labels[i])]
+        if detections.xyz is None:
+            return "{} {:.2f}".format(predicted_class, detections.scores[i])
+        return "{} {:.2f} dis={:.2f}m".format(
+            predicted_class, detections.scores[i], detections.distances[i]
+        )
+
+    # ---------------------------------------------------#
+    #   边框厚度
+    # ---------------------------------------------------#
+    def get_thickness(self, width, height):
+        return int(max((width + height) // np.mean(self.input_shape), 1))
+
+    # ---------------------------------------------------#
+    #   在图片上绘制检测结果，image为PIL图像
+    # ---------------------------------------------------#
+    def render(self, image, detections):
+        if len(detections) == 0:
+            return image
+        return self.label_renderer.draw(
+            image,
+            detections.pixel_boxes,
+            detections.labels,
+            [self.get_label(detections, i) for i in range(len(detections))],
+            self.get_thickness(*image.size),
+        )
+
+    # ---------------------------------------------------#
+    #   直接在BGR的numpy图像上绘制，frame会被原地修改
+    # ---------------------------------------------------#
+    def render_bgr(self, frame, detections):
+        if len(detections) == 0:
+            return frame
+        return self.label_renderer.draw_bgr(
+            frame,
+            detections.pixel_boxes,
+            detections.labels,
+            [self.get_label(detections, i) for i in range(len(detections))],
+            self.get_thickness(frame.shape[1], frame.shape[0]),
+        )
@@ -0,0 +1,128 @@
+#-----------------------------------------------------------------------#
+#   yolo_onnx.py使用onnxruntime进行预测，不需要安装torch。
+#   onnx模型由predict.py的mode = 'export_onnx'导出，导出时需要onnx_decode = True，
+#   onnx_dynamic_batch = True时detect_batch可以一次预测多张图片。
+#-----------------------------------------------------------------------#
+import numpy as np
+
+from utils.utils import get_classes, show_config
+from utils.utils_bbox_numpy import non_max_suppression
+from utils.utils_preprocess import Preprocessor, image_hw
+from yolo_base import YOLOBase
+
+
+class OnnxYOLO(YOLOBase):
+    _defaults = {
+        # --------------------------------------------------------------------------#
+        #   onnx_path指向导出的onnx模型，classes_path与导出时使用的保持一致
+        # --------------------------------------------------------------------------#
+        "onnx_path": "model_data/models.onnx",
+        "classes_path": "model_data/coco_classes.txt",
+        # ---------------------------------------------------------------------#
+        #   输入图片的大小，必须与导出时一致
+        # ---------------------------------------------------------------------#
+        "input_shape": [640, 640],
+        # ---------------------------------------------------------------------#
+        #   只有得分大于置信度的预测框会被保留下来
+        # ---------------------------------------------------------------------#
+        "confidence": 0.5,
+        # ---------------------------------------------------------------------#
+        #   非极大抑制所用到的nms_iou大小
+        # ---------------------------------------------------------------------#
+        "nms_iou": 0.3,
+        # ---------------------------------------------------------------------#
+        #   每张图片最多保留的预测框数量，None时不限制
+        # ---------------------------------------------------------------------#
+        "max_det": 300,
+        # ---------------------------------------------------------------------#
+        #   该变量用于控制是否使用letterbox_image对输入图像进行不失真的resize
+        # ---------------------------------------------------------------------#
+        "letterbox_image": True,
+        # ---------------------------------------------------------------------#
+        #   onnxruntime使用的线程数，0为onnxruntime的默认值
+        # ---------------------------------------------------------------------#
+        "num_threads": 0,
+        **YOLOBase._defaults,
+    }
+
+    # ---------------------------------------------------#
+    #   初始化OnnxYOLO
+    # ---------------------------------------------------#
+    def __init__(self, **kwargs):
+        self.__dict__.update(self._defaults)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+            self._defaults[name] = value
+
+        self.class_names, self.num_classes = get_classes(self.classes_path)
+        self.init_base()
+        self.preprocessor = Preprocessor(
+            self.input_shape, self.letterbox_image, as_tensor=False
+        )
+        self.generate()
+
+        show_config(**self._defaults)
+
+    # ---------------------------------------------------#
+    #   载入onnx模型
+    # ---------------------------------------------------#
+    def generate(self):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.num_threads > 0:
+            options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(
+            self.onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        if len(self.session.get_outputs()) != 1:
+            raise ValueError(
+                "OnnxYOLO需要包含解码的onnx模型，请在导出时设置onnx_decode = True。"
+            )
+        self.input_name = self.session.get_inputs()[0].name
+        # ---------------------------------------------------#
+        #   batch_size固定为1的模型只能逐张预测
+        # ---------------------------------------------------#
+        self.dynamic_batch = not isinstance(self.session.get_inputs()[0].shape[0], int)
+        print("{} model, and classes loaded.".format(self.onnx_path))
+
+    # ---------------------------------------------------#
+    #   批量检测图片，与YOLO.detect_batch的输入输出相同
+    # ---------------------------------------------------#
+    def detect_batch(self, images, bgr=False):
+        if len(images) == 0:
+            return []
+        image_shapes = [image_hw(image) for image in images]
+        image_data = self.preprocessor(images, bgr=bgr)
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: image_data})[0]
+        else:
+            outputs = np.concatenate(
+                [
+                    self.session.run(None, {self.input_name: image_data[i : i + 1]})[0]
+                    for i in range(len(images))
+                ],
+                0,
+            )
+        results = non_max_suppression(
+            outputs,
+            self.num_classes,
+            self.input_shape,
+            np.stack(image_shapes, 0),
+            self.letterbox_image,
+            conf_thres=self.confidence,
+            nms_thres=self.nms_iou,
+            max_det=self.max_det,
+        )
+
+        detections = []
+        for result in results:
+            if result is None:
+                detections.append(None)
+                continue
+            top_label = np.array(result[:, 6], dtype="int32")
+            top_conf = result[:, 4] * result[:, 5]
+            top_boxes = result[:, :4]
+            detections.append((top_label, top_conf, top_boxes))
+        return detections